@@ -0,0 +1,268 @@
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.ArrayList;
+import java.util.List;
+
+import org.eclipse.jgit.lib.Repository;
+import org.refactoringminer.RefactoringMiner;
+import org.refactoringminer.api.GitHistoryRefactoringMiner;
+import org.refactoringminer.api.GitService;
+import org.refactoringminer.api.Refactoring;
+import org.refactoringminer.api.RefactoringHandler;
+import org.refactoringminer.rm1.GitHistoryRefactoringMinerImpl;
+import org.refactoringminer.util.GitServiceImpl;
+
+/**
+ * Long-lived RefactoringMiner worker that speaks the protocol described in miner_workers.py.
+ * RefactoringMiner is loaded once, so the JVM starts and warms up once per worker instead of
+ * once per job. The -a and -bc jobs of the miner stage are mined with one
+ * GitHistoryRefactoringMinerImpl and written in the layout of the RefactoringMiner -json output,
+ * any other arguments are passed to the RefactoringMiner command line in the same JVM.
+ *
+ * Usage, with the source launcher of Java 17 or newer:
+ * java -cp "<RefactoringMiner>/lib/*" src/RefactoringMinerWorker.java
+ */
+public class RefactoringMinerWorker {
+    private final GitService gitService = new GitServiceImpl();
+    private final GitHistoryRefactoringMiner miner = new GitHistoryRefactoringMinerImpl();
+
+    public static void main(String[] args) throws Exception {
+        // stdout is reserved for the responses, so everything else printed goes to stderr
+        PrintStream responses = new PrintStream(
+            new FileOutputStream(FileDescriptor.out), true, StandardCharsets.UTF_8);
+        System.setOut(System.err);
+
+        RefactoringMinerWorker worker = new RefactoringMinerWorker();
+        BufferedReader jobs = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = jobs.readLine()) != null) {
+            if (line.isBlank()) {
+                continue;
+            }
+            Job job;
+            try {
+                job = new JobParser(line).parse();
+            } catch (IllegalArgumentException e) {
+                System.err.println("Invalid job " + line + ": " + e.getMessage());
+                continue;
+            }
+            int returncode = worker.run(job.args);
+            responses.println("{\"id\": " + job.id + ", \"returncode\": " + returncode + "}");
+        }
+    }
+
+    int run(List<String> args) {
+        try {
+            int json = args.indexOf("-json");
+            String option = args.isEmpty() ? "" : args.get(0);
+            if (option.equals("-a") && json == args.size() - 2 && (json == 2 || json == 3)) {
+                String branch = json == 3 ? args.get(2) : null;
+                mine(args.get(1), args.get(json + 1), (repository, handler) ->
+                    miner.detectAll(repository, branch, handler));
+            } else if (option.equals("-bc") && json == 4 && args.size() == 6) {
+                mine(args.get(1), args.get(5), (repository, handler) ->
+                    miner.detectBetweenCommits(repository, args.get(2), args.get(3), handler));
+            } else {
+                RefactoringMiner.main(args.toArray(new String[0]));
+            }
+            return 0;
+        } catch (Exception e) {
+            System.err.println("RefactoringMiner failed for " + args + ": " + e);
+            e.printStackTrace(System.err);
+            return 1;
+        }
+    }
+
+    interface Detection {
+        void detect(Repository repository, RefactoringHandler handler) throws Exception;
+    }
+
+    private void mine(String repositoryPath, String jsonPath, Detection detection) throws Exception {
+        try (Repository repository = gitService.openRepository(repositoryPath)) {
+            String cloneURL = repository.getConfig().getString("remote", "origin", "url");
+            StringBuilder json = new StringBuilder("{\n\"commits\": [\n");
+
+            detection.detect(repository, new RefactoringHandler() {
+                private int commits = 0;
+
+                @Override
+                public void handle(String commitId, List<Refactoring> refactorings) {
+                    if (commits++ > 0) {
+                        json.append(",\n");
+                    }
+                    appendCommit(json, cloneURL, commitId, refactorings);
+                }
+
+                @Override
+                public void handleException(String commitId, Exception e) {
+                    System.err.println("Error processing commit " + commitId);
+                    e.printStackTrace(System.err);
+                }
+            });
+
+            json.append("\n]\n}");
+            Files.writeString(Path.of(jsonPath), json, StandardCharsets.UTF_8);
+        }
+    }
+
+    private static void appendCommit(
+            StringBuilder json, String cloneURL, String commitId, List<Refactoring> refactorings) {
+        String url = cloneURL == null ? "" : GitHistoryRefactoringMinerImpl.extractCommitURL(cloneURL, commitId);
+        json.append("{\n");
+        json.append("\t\"repository\": ").append(quote(cloneURL == null ? "" : cloneURL)).append(",\n");
+        json.append("\t\"sha1\": ").append(quote(commitId)).append(",\n");
+        json.append("\t\"url\": ").append(quote(url)).append(",\n");
+        json.append("\t\"refactorings\": [");
+        for (int index = 0; index < refactorings.size(); index++) {
+            json.append(refactorings.get(index).toJSON());
+            if (index < refactorings.size() - 1) {
+                json.append(",");
+            }
+            json.append("\n");
+        }
+        json.append("]\n}");
+    }
+
+    private static String quote(String value) {
+        StringBuilder quoted = new StringBuilder("\"");
+        for (char character : value.toCharArray()) {
+            switch (character) {
+                case '"' -> quoted.append("\\\"");
+                case '\\' -> quoted.append("\\\\");
+                case '\n' -> quoted.append("\\n");
+                case '\r' -> quoted.append("\\r");
+                case '\t' -> quoted.append("\\t");
+                default -> {
+                    if (character < 0x20) {
+                        quoted.append(String.format("\\u%04x", (int) character));
+                    } else {
+                        quoted.append(character);
+                    }
+                }
+            }
+        }
+        return quoted.append('"').toString();
+    }
+
+    record Job(long id, List<String> args) {
+    }
+
+    /** Parses the {"id": <int>, "args": [<string>, ...]} lines written by miner_workers.py. */
+    static class JobParser {
+        private final String text;
+        private int position = 0;
+
+        JobParser(String text) {
+            this.text = text;
+        }
+
+        Job parse() {
+            Long id = null;
+            List<String> args = null;
+            expect('{');
+            while (peek() != '}') {
+                String key = parseString();
+                expect(':');
+                if (key.equals("id")) {
+                    id = parseNumber();
+                } else if (key.equals("args")) {
+                    args = parseStrings();
+                } else {
+                    throw new IllegalArgumentException("unknown key " + key);
+                }
+                if (peek() == ',') {
+                    position++;
+                }
+            }
+            if (id == null || args == null) {
+                throw new IllegalArgumentException("id and args are required");
+            }
+            return new Job(id, args);
+        }
+
+        private char peek() {
+            while (position < text.length() && Character.isWhitespace(text.charAt(position))) {
+                position++;
+            }
+            if (position >= text.length()) {
+                throw new IllegalArgumentException("unexpected end of line");
+            }
+            return text.charAt(position);
+        }
+
+        private void expect(char character) {
+            if (peek() != character) {
+                throw new IllegalArgumentException("expected " + character + " at " + position);
+            }
+            position++;
+        }
+
+        private long parseNumber() {
+            peek();
+            int start = position;
+            while (position < text.length()
+                    && (Character.isDigit(text.charAt(position)) || text.charAt(position) == '-')) {
+                position++;
+            }
+            try {
+                return Long.parseLong(text.substring(start, position));
+            } catch (NumberFormatException e) {
+                throw new IllegalArgumentException("invalid number at " + start);
+            }
+        }
+
+        private List<String> parseStrings() {
+            List<String> strings = new ArrayList<>();
+            expect('[');
+            while (peek() != ']') {
+                strings.add(parseString());
+                if (peek() == ',') {
+                    position++;
+                }
+            }
+            position++;
+            return strings;
+        }
+
+        private String parseString() {
+            expect('"');
+            StringBuilder value = new StringBuilder();
+            while (position < text.length()) {
+                char character = text.charAt(position++);
+                if (character == '"') {
+                    return value.toString();
+                }
+                if (character != '\\') {
+                    value.append(character);
+                    continue;
+                }
+                if (position >= text.length()) {
+                    break;
+                }
+                char escaped = text.charAt(position++);
+                switch (escaped) {
+                    case 'n' -> value.append('\n');
+                    case 'r' -> value.append('\r');
+                    case 't' -> value.append('\t');
+                    case 'b' -> value.append('\b');
+                    case 'f' -> value.append('\f');
+                    case 'u' -> {
+                        if (position + 4 > text.length()) {
+                            throw new IllegalArgumentException("invalid escape at " + position);
+                        }
+                        value.append((char) Integer.parseInt(text.substring(position, position + 4), 16));
+                        position += 4;
+                    }
+                    default -> value.append(escaped);
+                }
+            }
+            throw new IllegalArgumentException("unterminated string");
+        }
+    }
+}
@@ -0,0 +1,68 @@
+"""
+Benchmark of the pydriller stage backends on one repository.
+Both backends drill the same commits, the wall-clock times are printed and the records
+are compared to check that the git backend produces exactly the same output.
+
+Usage: python benchmark_pydriller_backends.py <repository path> [--miner-results <repo>.json]
+Without --miner-results every commit reachable from HEAD is drilled.
+"""
+
+import argparse
+import json
+import subprocess
+import time
+
+import miner_results
+import repository_pydriller
+
+
+def get_commits(repository_path, miner_results_file):
+    if miner_results_file:
+        return [
+            commit["sha1"]
+            for commit in miner_results.iter_refactoring_commits(miner_results_file)
+        ]
+
+    result = subprocess.run(
+        ["git", "-C", repository_path, "rev-list", "HEAD"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.split()
+
+
+def run_backend(repository_path, commits, backend):
+    start = time.perf_counter()
+    records = list(
+        repository_pydriller.iter_commit_records(repository_path, commits, backend)
+    )
+    elapsed = time.perf_counter() - start
+    # Compare the records the way they end up in the result files
+    return json.loads(json.dumps(records)), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("repository_path")
+    parser.add_argument("--miner-results", help="RefactoringMiner result file of the repository")
+    args = parser.parse_args()
+
+    commits = get_commits(args.repository_path, args.miner_results)
+    print(f"Drilling {len(commits)} commits of {args.repository_path}")
+
+    results = {}
+    for backend in repository_pydriller.BACKENDS:
+        records, elapsed = run_backend(args.repository_path, commits, backend)
+        results[backend] = records
+        print(f"{backend:>10}: {elapsed:8.2f} s, {len(records) / max(elapsed, 1e-9):10.1f} commits/s")
+
+    if results["pydriller"] == results["git"]:
+        print("The backends produced identical records")
+    else:
+        print("The backends produced different records")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-import requests
+import asyncio
 import json
-import time
 import os
+import time
+from itertools import chain
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+
+import repository_availability
+from issue_writer import IssueWriter, dedupe_issues, get_issues_path, read_issues
+from repository_availability import MAX_RETRIES, get_backoff_delay
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 if not GITHUB_TOKEN:
@@ -9,42 +15,180 @@ if not GITHUB_TOKEN:
 
 headers = {"Authorization": f"token {GITHUB_TOKEN}"}
 
-def check_if_issues_enabled(repo_url):
+GITHUB_API_URL = "https://api.github.com"
+PER_PAGE = 100  # The maximum the GitHub API allows
+ISSUES_DIR = "./results/issues/github_issues"
+SYNC_STATE_DIR = f"{ISSUES_DIR}/.state"
+METADATA_CACHE_FILE = "./results/cache/github_repository_metadata.json"
+METADATA_FIELDS = (
+    "hasIssuesEnabled isArchived defaultBranchRef { name } issues { totalCount }"
+    " openIssues: issues(states: OPEN) { totalCount } pullRequests { totalCount }"
+)
+
+def parse_repo_url(repo_url):
     parts = repo_url.strip().split(":")[-1].replace(".git", "").split("/")
-    owner = parts[0]
-    repo = parts[1]
-
-    api_url = f"https://api.github.com/repos/{owner}/{repo}"
-    
-    response = requests.get(api_url, headers=headers)
-    
-    if response.status_code == 200:
-        repo_data = response.json()
+    return parts[-2], parts[-1]
+
+def get_retry_delay(response, attempt):
+    """Seconds to wait before retrying the request, None if it should not be retried."""
+    if response.status == 403 and response.headers.get("X-RateLimit-Remaining") == "0":
+        # The primary rate limit resets at the given epoch time
+        reset_at = int(response.headers.get("X-RateLimit-Reset", 0))
+        return max(1, reset_at - time.time())
+    if response.status in (403, 429) and "Retry-After" in response.headers:
+        # Secondary rate limit
+        return get_backoff_delay(attempt, response)
+    if response.status >= 500:
+        return get_backoff_delay(attempt)
+    return None
+
+async def get_json(session, url, semaphore, params=None, etag=None):
+    """
+    GET a GitHub API URL, waiting out rate limits and retrying server errors. With an etag the
+    request is conditional, and the status is 304 if the response has not changed.
+    Returns (status, JSON body or None, response links, ETag of the response).
+    """
+    request_headers = {**headers, "If-None-Match": etag} if etag else headers
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with semaphore:
+                async with session.get(
+                    url,
+                    headers=request_headers,
+                    params=params,
+                    timeout=ClientTimeout(total=120),
+                ) as response:
+                    delay = get_retry_delay(response, attempt)
+                    if delay is None:
+                        data = await response.json() if response.status == 200 else None
+                        return (
+                            response.status,
+                            data,
+                            response.links,
+                            response.headers.get("ETag"),
+                        )
+        except (ClientError, asyncio.TimeoutError) as e:
+            print(f"Request to {url} failed: {e}")
+            delay = get_backoff_delay(attempt)
+
+        print(f"Rate limited or server error on {url}, retrying in {int(delay)} seconds...")
+        await asyncio.sleep(delay)
+
+    return None, None, {}, None
+
+async def check_if_issues_enabled(session, repo_url, semaphore):
+    owner, repo = parse_repo_url(repo_url)
+    status, repo_data, _, _ = await get_json(
+        session, f"{GITHUB_API_URL}/repos/{owner}/{repo}", semaphore
+    )
+
+    if status == 200:
         return repo_data.get("has_issues", False)
-    elif response.status_code == 403:
-        print("Rate limit reached or access denied. Waiting for 60 seconds before retrying...")
-        time.sleep(5)  # Wait for 5 seconds before retrying
-        return check_if_issues_enabled(repo_url)  # Retry after delay
     else:
-        print(f"Failed to fetch data for {repo_url}: {response.status_code}")
+        print(f"Failed to fetch data for {repo_url}: {status}")
         return None
 
-def categorize_repos_by_issues_status(file_path):
+def load_metadata_cache():
+    try:
+        with open(METADATA_CACHE_FILE, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_metadata_cache(cache):
+    os.makedirs(os.path.dirname(METADATA_CACHE_FILE), exist_ok=True)
+    with open(f"{METADATA_CACHE_FILE}.tmp", "w") as file:
+        json.dump(cache, file, indent=4)
+    os.replace(f"{METADATA_CACHE_FILE}.tmp", METADATA_CACHE_FILE)
+
+def to_metadata(repository):
+    return {
+        "has_issues": repository["hasIssuesEnabled"],
+        "issue_count": repository["issues"]["totalCount"],
+        "open_issue_count": repository["openIssues"]["totalCount"],
+        # The REST issues endpoint lists the pull requests too
+        "pull_request_count": repository["pullRequests"]["totalCount"],
+        "default_branch": (repository["defaultBranchRef"] or {}).get("name"),
+        "archived": repository["isArchived"],
+        "fetched_at": time.time(),
+    }
+
+async def get_repository_metadata(session, repo_urls, semaphore, ttl=24 * 60 * 60):
+    """
+    Return {repo_url: metadata or None} with whether the repository has issues enabled, its
+    issue and pull request counts, default branch and archived status. The metadata is cached in
+    METADATA_CACHE_FILE, and the repositories without a fresh entry are looked up 100 per
+    GraphQL query. Repositories GraphQL can't resolve only get has_issues over REST.
+    """
+    cache = load_metadata_cache()
+    keys = {repo_url: "/".join(parse_repo_url(repo_url)).lower() for repo_url in repo_urls}
+    stale_urls = [
+        repo_url
+        for repo_url in repo_urls
+        if time.time() - cache.get(keys[repo_url], {}).get("fetched_at", 0) >= ttl
+    ]
+
+    if stale_urls:
+        print(f"Fetching the metadata of {len(stale_urls)} repositories...")
+        resolved = await repository_availability.query_repositories(
+            session,
+            GITHUB_TOKEN,
+            [parse_repo_url(repo_url) for repo_url in stale_urls],
+            METADATA_FIELDS,
+            semaphore,
+        )
+
+        for repo_url in stale_urls:
+            repository = resolved.get(parse_repo_url(repo_url), False)
+            if repository:
+                cache[keys[repo_url]] = to_metadata(repository)
+            elif repository is None:
+                print(f"Repository {repo_url} was not found")
+                cache.pop(keys[repo_url], None)
+
+        unresolved_urls = [
+            repo_url for repo_url in stale_urls if parse_repo_url(repo_url) not in resolved
+        ]
+        has_issues = await asyncio.gather(
+            *(check_if_issues_enabled(session, repo_url, semaphore) for repo_url in unresolved_urls)
+        )
+        for repo_url, result in zip(unresolved_urls, has_issues):
+            if result is not None:
+                cache[keys[repo_url]] = {
+                    "has_issues": result,
+                    "issue_count": None,
+                    "open_issue_count": None,
+                    "pull_request_count": None,
+                    "default_branch": None,
+                    "archived": None,
+                    "fetched_at": time.time(),
+                }
+
+        save_metadata_cache(cache)
+
+    return {repo_url: cache.get(keys[repo_url]) for repo_url in repo_urls}
+
+async def categorize_repos_by_issues_status(file_path, concurrency=10, metadata_ttl=24 * 60 * 60):
     issues_enabled = []
     issues_disabled = []
 
     # Open and read the text file
     with open(file_path, "r") as txt_file:
-        for line in txt_file:
-            repo_url = line.strip()  # Remove any leading/trailing whitespace
-            if repo_url:  # Check if the line is not empty
-                result = check_if_issues_enabled(repo_url)
-                if result is True:
-                    issues_enabled.append(repo_url)
-                elif result is False:
-                    issues_disabled.append(repo_url)
-                else:
-                    print(f"Could not determine issue tracking status for {repo_url}.")
+        repo_urls = [line.strip() for line in txt_file if line.strip()]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        metadata = await get_repository_metadata(session, repo_urls, semaphore, metadata_ttl)
+
+    for repo_url in repo_urls:
+        result = metadata[repo_url]["has_issues"] if metadata[repo_url] else None
+        if result is True:
+            issues_enabled.append(repo_url)
+        elif result is False:
+            issues_disabled.append(repo_url)
+        else:
+            print(f"Could not determine issue tracking status for {repo_url}.")
 
     # Write results to text files
     os.makedirs("./results/issues", exist_ok=True)
@@ -58,49 +202,188 @@ def categorize_repos_by_issues_status(file_path):
 
     print("Results saved to 'github_issues_enabled.txt' and 'github_issues_disabled.txt'.")
 
-def fetch_all_issues(owner, repo):
-    issues = []
-    page = 1
-    while True:
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/issues"
-        params = {"state": "all", "page": page, "per_page": 1000}  # Fetch 1000 issues per page
-        response = requests.get(api_url, headers=headers, params=params)
-
-        if response.status_code == 200:
-            page_issues = response.json()
-            if not page_issues:
-                break  # Exit if no more issues on this page
-            issues.extend(page_issues)
-            page += 1
-        elif response.status_code == 403:
-            print("Rate limit reached while fetching issues. Waiting for 60 seconds before retrying...")
-            time.sleep(60)  # Wait and retry
-        else:
-            print(f"Failed to fetch issues for {owner}/{repo}: {response.status_code}")
-            break
-    
-    # Save issues to a JSON file named after the repository
-    if issues:
-        os.makedirs("./results/issues/github_issues", exist_ok=True)
-        file_path = f"./results/issues/github_issues/{owner}_{repo}_issues.json"
-        with open(file_path, "w") as file:
-            json.dump(issues, file, indent=4)
-        print(f"Issues saved to {file_path}")
+def get_last_page(links, page=1):
+    """Number of the last page from the Link header, which has no last link on the last page."""
+    last = links.get("last")
+    return int(last["url"].query.get("page", page)) if last else page
+
+def load_sync_state(owner, repo):
+    try:
+        with open(f"{SYNC_STATE_DIR}/{owner}_{repo}.json", "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_sync_state(owner, repo, state):
+    os.makedirs(SYNC_STATE_DIR, exist_ok=True)
+    state_path = f"{SYNC_STATE_DIR}/{owner}_{repo}.json"
+    with open(f"{state_path}.tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(f"{state_path}.tmp", state_path)
+
+def merge_issue_updates(file_path, updates_path, compress):
+    """
+    Merge the updated issues into the stored issues by id, reading the stored issues as a stream.
+    Updated issues that are not stored yet are new and go last, as the stored issues are oldest
+    first. Returns the number of updated issues.
+    """
+    updates = {issue["id"]: issue for issue in read_issues(updates_path, compress)}
+    stored_ids = {issue["id"] for issue in read_issues(file_path, compress)}
+    new_issues = sorted(
+        (issue for issue_id, issue in updates.items() if issue_id not in stored_ids),
+        key=lambda issue: issue["number"],
+    )
+    merged_issues = chain(
+        (updates.get(issue["id"], issue) for issue in read_issues(file_path, compress)),
+        new_issues,
+    )
+
+    with IssueWriter(f"{file_path}.tmp", compress).open(resume=False) as writer:
+        writer.write_all(merged_issues)
+        writer.finish()
+    os.replace(f"{file_path}.tmp", file_path)
+    os.remove(updates_path)
+    return len(updates)
+
+async def fetch_issues_page(session, owner, repo, page, semaphore, since=None, etag=None):
+    params = {"state": "all", "page": page, "per_page": PER_PAGE}
+    if since:
+        # Most recently updated first, so any update changes the first page and its ETag
+        params.update({"since": since, "sort": "updated", "direction": "desc"})
     else:
+        # Oldest first, so issues created meanwhile don't move the pages of a resumed fetch
+        params.update({"sort": "created", "direction": "asc"})
+    return await get_json(
+        session, f"{GITHUB_API_URL}/repos/{owner}/{repo}/issues", semaphore, params, etag
+    )
+
+async def fetch_all_issues(session, owner, repo, semaphore, sync=True, compress=False):
+    """
+    Fetch the issues of the repository into <owner>_<repo>_issues.jsonl (.jsonl.gz with compress),
+    writing every page as it arrives, see issue_writer. An interrupted fetch continues from the
+    last page it wrote, and the duplicates are dropped once it's finished. With sync only the
+    issues updated since the last run are fetched, into an updates file that is merged into the
+    stored issues by id once complete. The first page is requested with the ETag of the last run,
+    so nothing is downloaded if nothing has changed.
+    """
+    file_path = get_issues_path(f"{ISSUES_DIR}/{owner}_{repo}_issues", compress)
+    state = load_sync_state(owner, repo) if sync else None
+    if not os.path.exists(file_path) or IssueWriter(file_path).marker:
+        # Nothing stored yet, or a full fetch to finish first
+        state = None
+
+    since = state["since"] if state else None
+    writer = IssueWriter(f"{file_path}.updates" if since else file_path, compress)
+    # A fetch can only be resumed with the same query
+    resuming = writer.marker is not None and writer.resume_state.get("since") == since
+    # The last written page is fetched again, in case removed issues have moved the pages
+    first_page_number = max(1, writer.resume_position - 1) if resuming else 1
+    max_updated_at = writer.resume_state.get("max_updated_at") if resuming else None
+    etag = state.get("etag") if state and not resuming else None
+
+    status, first_page, links, first_page_etag = await fetch_issues_page(
+        session, owner, repo, first_page_number, semaphore, since, etag
+    )
+    if status == 304:
+        print(f"No issues updated for {owner}/{repo} since {since}")
+        return
+    if status != 200:
+        print(f"Failed to fetch issues for {owner}/{repo}: {status}")
+        return
+    if resuming:
+        print(f"Resuming the issues of {owner}/{repo} from page {first_page_number}")
+
+    async def write_page(page, issues):
+        nonlocal max_updated_at
+        updated_at = [issue["updated_at"] for issue in issues]
+        if max_updated_at:
+            updated_at.append(max_updated_at)
+        max_updated_at = max(updated_at, default=None)
+        # Encoding, compressing and syncing a page would hold up the other requests
+        await asyncio.to_thread(
+            writer.write_page, issues, page + 1, {"since": since, "max_updated_at": max_updated_at}
+        )
+
+    # The first page tells how many pages there are. The rest are fetched concurrently
+    # and written in order, so the file always ends with the last completed page
+    last_page = get_last_page(links, first_page_number)
+    pages = range(first_page_number + 1, last_page + 1)
+    tasks = [
+        asyncio.create_task(fetch_issues_page(session, owner, repo, page, semaphore, since))
+        for page in pages
+    ]
+
+    try:
+        with writer.open(resume=resuming):
+            await write_page(first_page_number, first_page)
+            for page, task in zip(pages, tasks):
+                status, page_issues, _, _ = await task
+                if status != 200:
+                    print(
+                        f"Failed to fetch page {page} of the issues for {owner}/{repo}: {status},"
+                        " the next run continues from the last page written"
+                    )
+                    return
+                await write_page(page, page_issues)
+            writer.finish()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if since:
+        updated_count = await asyncio.to_thread(
+            merge_issue_updates, file_path, writer.path, compress
+        )
+        print(f"{updated_count} issues updated for {owner}/{repo} since {since}")
+    elif max_updated_at is None:
+        os.remove(file_path)
         print(f"No issues found for {owner}/{repo}")
+        return
+    elif resuming:
+        await asyncio.to_thread(dedupe_issues, file_path, compress)
+    print(f"Issues saved to {file_path}")
+
+    # since is inclusive, so the next run gets at least the latest issue again. The ETag
+    # is only valid for the same query, so it is kept only while the high-water mark stays
+    new_since = max(filter(None, (since, max_updated_at)))
+    keep_etag = new_since == since and first_page_number == 1
+    save_sync_state(
+        owner, repo, {"since": new_since, "etag": first_page_etag if keep_etag else None}
+    )
 
-def fetch_issues_from_repos_in_file(file_path):
+async def fetch_issues_of_repo(session, repo_url, metadata, semaphore, sync, compress):
+    owner, repo = parse_repo_url(repo_url)
+    if metadata is None:
+        print(f"Could not determine issue tracking status for {repo_url}.")
+    elif metadata["issue_count"] == 0 and metadata.get("pull_request_count") == 0:
+        # Nothing for the issues endpoint to list, which returns pull requests as well
+        print(f"No issues or pull requests found for {owner}/{repo}")
+    elif metadata["has_issues"]:
+        print(f"Fetching issues for {owner}/{repo}...")
+        await fetch_all_issues(session, owner, repo, semaphore, sync, compress)
+    else:
+        print(f"{repo_url} does not have issues enabled.")
+
+async def fetch_issues_from_repos_in_file(
+    file_path, concurrency=10, sync=True, metadata_ttl=24 * 60 * 60, compress=False
+):
+    """
+    Fetch the issues of the repositories in the file, with at most concurrency requests at a time.
+    With sync only the issues updated since the last run are fetched, see fetch_all_issues.
+    With compress the issue files are gzip compressed.
+    Whether the repositories have issues comes from the metadata cache, see get_repository_metadata.
+    """
     with open(file_path, "r") as txt_file:
-        for line in txt_file:
-            repo_url = line.strip()
-            if repo_url:
-                has_issues = check_if_issues_enabled(repo_url)
-                if has_issues:
-                    # Extract owner and repo name from the SSH URL
-                    parts = repo_url.strip().split(":")[-1].replace(".git", "").split("/")
-                    owner = parts[0]
-                    repo = parts[1]
-                    print(f"Fetching issues for {owner}/{repo}...")
-                    fetch_all_issues(owner, repo)
-                else:
-                    print(f"{repo_url} does not have issues enabled.")
\ No newline at end of file
+        repo_urls = [line.strip() for line in txt_file if line.strip()]
+
+    semaphore = asyncio.Semaphore(concurrency)
+    async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+        metadata = await get_repository_metadata(session, repo_urls, semaphore, metadata_ttl)
+        await asyncio.gather(
+            *(
+                fetch_issues_of_repo(
+                    session, repo_url, metadata[repo_url], semaphore, sync, compress
+                )
+                for repo_url in repo_urls
+            )
+        )
@@ -5,6 +5,8 @@ import os
 import shutil
 import re
 
+from issue_writer import IssueWriter, dedupe_issues, get_issues_path
+
 # JIRA API endpoint for fetching all projects
 url = "https://issues.apache.org/jira/rest/api/2/project"
 
@@ -122,50 +124,71 @@ def load_closest_matches(file_path):
     with open(file_path, 'r') as f:
         return json.load(f)
 
-def fetch_issues(project_key, start_at=0):
-    """Fetch issues for a given project key using JIRA API, with pagination and progress tracking."""
-    issues = []
+def fetch_issues(project_key, file_path, compress=False):
+    """
+    Fetch issues for a given project key using JIRA API, with pagination and progress tracking.
+    Every page is appended to the file as it arrives, see issue_writer. The issues are listed by
+    key so that the offsets stay the same, and an interrupted fetch continues from the last page
+    it wrote. The duplicates are dropped once it's finished. Returns the number of issues fetched,
+    or None if the fetch stopped on an error and is continued on the next run.
+    """
+    writer = IssueWriter(file_path, compress)
+    resuming = writer.resume_position is not None
+    # The last written page is fetched again, in case removed issues have moved the offsets
+    start_at = writer.resume_state.get("page_start", 0)
+    fetched_count = start_at
     total_issues = None  # Will be set after the first request
-    
-    while True:
-        url = f"{BASE_URL}?jql=project={project_key}&startAt={start_at}&maxResults={MAX_RESULTS}"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            data = response.json()
-            issues.extend(data["issues"])
-            
-            # Set the total number of issues only after the first request
-            if total_issues is None:
-                total_issues = data["total"]
-                print(f"Total issues to fetch for project {project_key}: {total_issues}")
-            
-            # Show progress
-            fetched_count = start_at + len(data["issues"])
-            print(f"Fetched {fetched_count} of {total_issues} issues for project {project_key}")
-            
-            # Check if we've fetched all issues
-            if fetched_count >= total_issues:
-                break
+
+    if resuming:
+        print(f"Resuming the issues of project {project_key} from issue {start_at}")
+
+    with writer.open(resume=resuming):
+        while True:
+            params = {
+                "jql": f"project={project_key} ORDER BY key ASC",
+                "startAt": start_at,
+                "maxResults": MAX_RESULTS,
+            }
+            response = requests.get(BASE_URL, params=params)
             
-            start_at += MAX_RESULTS
-            time.sleep(RATE_LIMIT_WAIT)  # Rate limiting
-        else:
-            print(f"Error fetching issues for project {project_key}: HTTP {response.status_code}")
-            print("Response content:", response.text)
-            break
+            if response.status_code == 200:
+                data = response.json()
+                # The server may return fewer issues than asked for,
+                # so the next page starts after these
+                fetched_count = start_at + len(data["issues"])
+                writer.write_page(data["issues"], fetched_count, {"page_start": start_at})
+                
+                # Set the total number of issues only after the first request
+                if total_issues is None:
+                    total_issues = data["total"]
+                    print(f"Total issues to fetch for project {project_key}: {total_issues}")
+                
+                # Show progress
+                print(f"Fetched {fetched_count} of {total_issues} issues for project {project_key}")
+                
+                # Check if we've fetched all issues
+                if fetched_count >= total_issues or not data["issues"]:
+                    writer.finish()
+                    if resuming:
+                        dedupe_issues(file_path, compress)
+                    break
+                
+                start_at = fetched_count
+                time.sleep(RATE_LIMIT_WAIT)  # Rate limiting
+            else:
+                print(f"Error fetching issues for project {project_key}: HTTP {response.status_code}")
+                print("Response content:", response.text)
+                print("The next run continues from the last page written")
+                return None
             
-    return issues
+    return fetched_count
 
-def save_issues_to_file(project_name, issues, output_folder):
-    """Save the issues for each project to a JSON file named after the project name."""
+def get_issues_file(project_name, output_folder, compress=False):
+    """The file for the issues of a project, named after the project name."""
     # Use the project name, replacing spaces with underscores, as the file name
-    file_name = f"{output_folder}/{project_name.replace(' ', '_')}_issues.json"
-    with open(file_name, 'w') as f:
-        json.dump(issues, f, indent=4)
-    print(f"Issues for project {project_name} saved to {file_name}")
+    return get_issues_path(f"{output_folder}/{project_name.replace(' ', '_')}_issues", compress)
 
-def fetch_and_save_issues(issues_folder_path, repo_list_file):
+def fetch_and_save_issues(issues_folder_path, repo_list_file, compress=False):
     
     parse_repository_list(f"{issues_folder_path}/{repo_list_file}", f"{issues_folder_path}/parsed_names_collection.json")
 
@@ -209,8 +232,9 @@ def fetch_and_save_issues(issues_folder_path, repo_list_file):
             else:
                 # Fetch and save issues if this is the first time encountering the project key
                 print(f"Fetching issues for project: {project_name} (Project Key: {project_key})")
-                issues = fetch_issues(project_key)
-                save_issues_to_file(project_name, issues, f"{issues_folder_path}/jira_issues")
+                file_path = get_issues_file(project_name, save_issues_location, compress)
+                if fetch_issues(project_key, file_path, compress) is not None:
+                    print(f"Issues for project {project_name} saved to {file_path}")
                 processed_projects[project_key] = project_name  # Track the processed project key
         else:
             print(f"No valid project key for {parsed_name}, skipping...")
\ No newline at end of file
@@ -0,0 +1,263 @@
+import os
+import subprocess
+import threading
+
+"""
+Native git backend for the pydriller stage. All the filtered commits are diffed by a single
+`git diff-tree --stdin` process and its patch output is parsed incrementally, instead of
+PyDriller spawning git and building Commit/ModifiedFile objects for every commit.
+The records produced are the same as the ones repository_pydriller.pydrill builds from PyDriller:
+commits come in the same order, merge commits have no modified files and the diff is parsed
+with the same rules as ModifiedFile.diff_parsed, added_lines and deleted_lines.
+"""
+
+# The same options GitPython passes when PyDriller asks for the diff of a commit
+DIFF_TREE_COMMAND = [
+    "git",
+    "-c",
+    "core.quotePath=false",
+    "diff-tree",
+    "--stdin",
+    "--root",
+    "-r",
+    "-M",
+    "-p",
+    "--abbrev=40",
+    "--full-index",
+    "--no-ext-diff",
+    "--no-color",
+]
+
+
+def list_commits_in_order(repository_path, commit_shas):
+    """
+    Return (sha, first parent) of the given commits in the order PyDriller traverses them,
+    which is `git rev-list --reverse HEAD`. Commits not reachable from HEAD are left out,
+    as PyDriller does.
+    """
+    wanted = set(commit_shas)
+    commits = []
+
+    with subprocess.Popen(
+        ["git", "-C", repository_path, "rev-list", "--reverse", "--parents", "HEAD"],
+        stdout=subprocess.PIPE,
+        text=True,
+    ) as proc:
+        for line in proc.stdout:
+            sha, *parents = line.split()
+            if sha in wanted:
+                commits.append((sha, parents[0] if parents else None))
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, "git rev-list")
+
+    return commits
+
+
+def unquote_path(path):
+    """Undo the C-style quoting git uses for paths with special characters."""
+    if len(path) > 1 and path.startswith('"') and path.endswith('"'):
+        return (
+            path[1:-1]
+            .encode("latin-1", errors="backslashreplace")
+            .decode("unicode_escape")
+            .encode("latin-1")
+            .decode("utf-8", errors="ignore")
+        )
+    return path
+
+
+def parse_header_path(line, prefix):
+    """Path of a "--- a/x" or "+++ b/x" line, None for /dev/null."""
+    # git terminates paths containing spaces with a tab on these lines
+    path = unquote_path(line[4:].rstrip("\t"))
+    if path == "/dev/null":
+        return None
+    return path[len(prefix) :] if path.startswith(prefix) else path
+
+
+def parse_diff_git_paths(line):
+    """Paths of a "diff --git a/x b/x" line, only reliable when the paths are the same."""
+    paths = line[len("diff --git ") :]
+    if paths.startswith('"'):
+        # Find the closing quote, skipping escaped characters
+        old_end = 1
+        while paths[old_end] != '"':
+            old_end += 2 if paths[old_end] == "\\" else 1
+        old_end += 1
+        return unquote_path(paths[:old_end])[2:], unquote_path(paths[old_end + 1 :])[2:]
+
+    half = (len(paths) - 1) // 2
+    return paths[2:half], paths[half + 3 :]
+
+
+def count_diff_lines(diff):
+    added_lines = 0
+    deleted_lines = 0
+
+    for line in diff.replace("\r", "").split("\n"):
+        if line.startswith("+") and not line.startswith("+++"):
+            added_lines += 1
+        if line.startswith("-") and not line.startswith("---"):
+            deleted_lines += 1
+
+    return added_lines, deleted_lines
+
+
+def parse_diff(diff):
+    """Added and deleted lines of a diff as (line number, line), like ModifiedFile.diff_parsed."""
+    modified_lines = {"added": [], "deleted": []}
+    count_deletions = 0
+    count_additions = 0
+
+    for line in diff.split("\n"):
+        line = line.rstrip()
+        count_deletions += 1
+        count_additions += 1
+
+        if line.startswith("@@"):
+            token = line.split(" ")
+            count_deletions = int(token[1].split(",")[0].replace("-", "")) - 1
+            count_additions = int(token[2].split(",")[0]) - 1
+
+        if line.startswith("-"):
+            modified_lines["deleted"].append((count_deletions, line[1:]))
+            count_additions -= 1
+
+        if line.startswith("+"):
+            modified_lines["added"].append((count_additions, line[1:]))
+            count_deletions -= 1
+
+        if line == r"\ No newline at end of file":
+            count_deletions -= 1
+            count_additions -= 1
+
+    return modified_lines
+
+
+class _FileDiff:
+    def __init__(self, header_line):
+        self.old_path, self.new_path = parse_diff_git_paths(header_line)
+        self.diff_lines = []
+        self.in_header = True
+
+    def add_line(self, line):
+        if not self.in_header:
+            self.diff_lines.append(line)
+        elif line.startswith("@@") or line.startswith("Binary files "):
+            self.in_header = False
+            self.diff_lines.append(line)
+        elif line.startswith("--- "):
+            self.old_path = parse_header_path(line, "a/")
+        elif line.startswith("+++ "):
+            self.new_path = parse_header_path(line, "b/")
+        elif line.startswith("rename from "):
+            self.old_path = unquote_path(line[len("rename from ") :])
+        elif line.startswith("rename to "):
+            self.new_path = unquote_path(line[len("rename to ") :])
+        elif line.startswith("new file mode"):
+            self.old_path = None
+        elif line.startswith("deleted file mode"):
+            self.new_path = None
+
+    def to_records(self):
+        path = self.new_path if self.new_path is not None else self.old_path
+        filename = os.path.basename(path)
+        diff = "\n".join(self.diff_lines)
+        added_lines, deleted_lines = count_diff_lines(diff)
+
+        diff_stats = {
+            "modified": filename,
+            "added_lines": added_lines,
+            "deleted_lines": deleted_lines,
+        }
+        diff_content = {
+            "modified": filename,
+            "diff": parse_diff(diff),
+        }
+        return diff_stats, diff_content
+
+
+def new_commit_data(sha, parent):
+    return {
+        "commit_hash": sha,
+        "previous_commit_hash": parent,
+        "diff stats": [],
+        "diff content": [],
+    }
+
+
+def add_file_diff(commit_data, file_diff):
+    if commit_data is not None and file_diff is not None:
+        diff_stats, diff_content = file_diff.to_records()
+        commit_data["diff stats"].append(diff_stats)
+        commit_data["diff content"].append(diff_content)
+
+
+def iter_commit_diffs(repository_path, commit_shas):
+    """Yield the "diff stats"/"diff content" record of every commit, one commit at a time."""
+    commits = list_commits_in_order(repository_path, commit_shas)
+    if not commits:
+        return
+
+    proc = subprocess.Popen(
+        DIFF_TREE_COMMAND,
+        cwd=repository_path,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+
+    # The shas are written from a thread, so a full stdout pipe cannot block the writer
+    def write_shas():
+        try:
+            for sha, _ in commits:
+                proc.stdin.write(f"{sha}\n".encode())
+            proc.stdin.close()
+        except BrokenPipeError:
+            # The reader stopped early and git has exited
+            pass
+
+    writer = threading.Thread(target=write_shas, daemon=True)
+    writer.start()
+
+    # diff-tree prints a line with the sha before the patch of each commit, and nothing at all
+    # for merge commits, so commits without a sha line in between are emitted as empty
+    positions = {sha: index for index, (sha, _) in enumerate(commits)}
+    next_index = 0
+    commit_data = None
+    file_diff = None
+
+    try:
+        for raw_line in proc.stdout:
+            line = raw_line.decode("utf-8", errors="ignore").rstrip("\n")
+
+            if positions.get(line, -1) >= next_index:
+                add_file_diff(commit_data, file_diff)
+                file_diff = None
+                if commit_data is not None:
+                    yield commit_data
+
+                while commits[next_index][0] != line:
+                    yield new_commit_data(*commits[next_index])
+                    next_index += 1
+                commit_data = new_commit_data(*commits[next_index])
+                next_index += 1
+            elif line.startswith("diff --git "):
+                add_file_diff(commit_data, file_diff)
+                file_diff = _FileDiff(line)
+            elif file_diff is not None:
+                file_diff.add_line(line)
+
+        add_file_diff(commit_data, file_diff)
+        if commit_data is not None:
+            yield commit_data
+
+        for sha, parent in commits[next_index:]:
+            yield new_commit_data(sha, parent)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        writer.join()
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, "git diff-tree --stdin")
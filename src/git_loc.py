@@ -0,0 +1,267 @@
+import os
+import subprocess
+from collections import defaultdict
+
+"""
+This module counts lines of code for a commit straight from the git object database.
+Nothing is checked out, so the working tree and index of the clone are never touched.
+Lines are counted the way scc counts its "Lines" column, binary files are skipped and so
+are files over scc's default size limits. Only a subset of the languages scc recognises is
+listed in LANGUAGE_EXTENSIONS and LANGUAGE_FILENAMES, files of any other language are not
+counted, so totals can be lower than what scc reports for the same commit.
+"""
+
+# Bump this whenever the counting rules or the language tables change so that cached counts
+# are invalidated
+COUNTER_VERSION = 1
+
+# scc defaults: files over 1000000 bytes or 40000 lines are not counted
+LARGE_BYTE_COUNT = 1000000
+LARGE_LINE_COUNT = 40000
+
+# scc treats a file as binary if there is a NUL byte in its first 10000 bytes
+BINARY_CHECK_BYTES = 10000
+
+# The tree of an empty repository, root commits are diffed against it
+EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+LANGUAGE_EXTENSIONS = {
+    "ActionScript": ["as"],
+    "Assembly": ["s", "asm"],
+    "Batch": ["bat", "btm", "cmd"],
+    "C": ["c", "ec", "pgc"],
+    "C Header": ["h"],
+    "C#": ["cs", "csx"],
+    "C++": ["cc", "cpp", "cxx", "c++", "pcc", "ino"],
+    "C++ Header": ["hh", "hpp", "hxx", "inl", "ipp"],
+    "CMake": ["cmake"],
+    "CSS": ["css"],
+    "CSV": ["csv"],
+    "Clojure": ["clj", "cljc"],
+    "CoffeeScript": ["coffee"],
+    "Dart": ["dart"],
+    "Erlang": ["erl", "hrl"],
+    "FreeMarker": ["ftl"],
+    "Go": ["go"],
+    "Go Template": ["tmpl", "gohtml", "gotxt"],
+    "Gradle": ["gradle"],
+    "Groovy": ["groovy", "grt", "gtpl", "gvy"],
+    "HTML": ["html", "htm"],
+    "Haskell": ["hs"],
+    "INI": ["ini"],
+    "JSON": ["json"],
+    "JSX": ["jsx"],
+    "Java": ["java"],
+    "JavaScript": ["js", "cjs", "mjs"],
+    "JavaServer Pages": ["jsp"],
+    "Kotlin": ["kt", "kts"],
+    "LESS": ["less"],
+    "Lua": ["lua"],
+    "Makefile": ["makefile", "mak", "mk"],
+    "Markdown": ["md", "markdown"],
+    "Objective C": ["m"],
+    "Objective C++": ["mm"],
+    "PHP": ["php"],
+    "Perl": ["pl", "pm"],
+    "Plain Text": ["text", "txt"],
+    "PowerShell": ["ps1", "psm1"],
+    "Properties File": ["properties"],
+    "Protocol Buffers": ["proto"],
+    "Python": ["py", "pyw", "pyi"],
+    "R": ["r"],
+    "ReStructuredText": ["rst"],
+    "Ruby": ["rb"],
+    "Rust": ["rs"],
+    "SQL": ["sql"],
+    "Sass": ["sass", "scss"],
+    "Scala": ["sc", "scala"],
+    "Shell": ["sh", "tcsh", "csh"],
+    "Swift": ["swift"],
+    "TOML": ["toml"],
+    "Thrift": ["thrift"],
+    "TypeScript": ["ts", "tsx"],
+    "Velocity Template Language": ["vm"],
+    "Vue": ["vue"],
+    "XML": ["xml", "xsd", "xsl", "xslt", "wsdl", "pom"],
+    "YAML": ["yaml", "yml"],
+}
+
+LANGUAGE_FILENAMES = {
+    "dockerfile": "Dockerfile",
+    "makefile": "Makefile",
+    "gnumakefile": "Makefile",
+    "cmakelists.txt": "CMake",
+    "jenkinsfile": "Jenkins Buildfile",
+    "license": "License",
+    "licence": "License",
+}
+
+EXTENSION_LANGUAGES = {
+    extension: language
+    for language, extensions in LANGUAGE_EXTENSIONS.items()
+    for extension in extensions
+}
+
+
+def detect_language(path):
+    file_name = os.path.basename(path).lower()
+
+    if file_name in LANGUAGE_FILENAMES:
+        return LANGUAGE_FILENAMES[file_name]
+
+    _, extension = os.path.splitext(file_name)
+    return EXTENSION_LANGUAGES.get(extension.lstrip("."))
+
+
+def count_lines(content):
+    if not content or b"\0" in content[:BINARY_CHECK_BYTES]:
+        return 0
+
+    lines = content.count(b"\n")
+    if not content.endswith(b"\n"):
+        lines += 1
+
+    return lines if lines <= LARGE_LINE_COUNT else 0
+
+
+def list_tree_blobs(repo_dir, commit_sha):
+    """Return (blob sha, path, language) for every counted file in the tree of the commit."""
+    result = subprocess.run(
+        ["git", "ls-tree", "-r", "-z", "--long", commit_sha],
+        capture_output=True,
+        check=True,
+        cwd=repo_dir,
+    )
+
+    blobs = []
+    for entry in result.stdout.split(b"\0"):
+        if not entry:
+            continue
+        meta, path = entry.split(b"\t", 1)
+        _, object_type, blob_sha, size = meta.split()
+        if object_type != b"blob" or size == b"-" or int(size) > LARGE_BYTE_COUNT:
+            continue
+        path = path.decode("utf-8", errors="surrogateescape")
+        language = detect_language(path)
+        if language:
+            blobs.append((blob_sha.decode(), path, language))
+
+    return blobs
+
+
+def read_blob_line_counts(repo_dir, blob_shas):
+    """Stream the blobs through a single `git cat-file --batch` and count their lines."""
+    counts = {}
+    if not blob_shas:
+        return counts
+
+    with subprocess.Popen(
+        ["git", "cat-file", "--batch"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        cwd=repo_dir,
+    ) as proc:
+        for blob_sha in blob_shas:
+            proc.stdin.write(f"{blob_sha}\n".encode())
+            proc.stdin.flush()
+
+            header = proc.stdout.readline().split()
+            if len(header) < 3 or header[1] != b"blob":
+                counts[blob_sha] = 0
+                continue
+
+            content = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)  # newline terminating the object
+            counts[blob_sha] = count_lines(content)
+
+        proc.stdin.close()
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, "git cat-file --batch")
+
+    return counts
+
+
+def count_commit_loc(repo_dir, commit_sha, blob_cache=None):
+    """
+    Count the lines of code per language in the tree of the commit.
+    Blob line counts are stored in blob_cache if one is given, so consecutive
+    commits of the same repository only read the blobs that changed.
+    """
+    if blob_cache is None:
+        blob_cache = {}
+
+    blobs = list_tree_blobs(repo_dir, commit_sha)
+    missing = list({blob_sha for blob_sha, _, _ in blobs if blob_sha not in blob_cache})
+    blob_cache.update(read_blob_line_counts(repo_dir, missing))
+
+    loc_per_language = defaultdict(int)
+    for blob_sha, _, language in blobs:
+        loc_per_language[language] += blob_cache[blob_sha]
+
+    return dict(loc_per_language)
+
+
+def get_committer_name(repo_dir, commit_sha):
+    commit = subprocess.run(
+        ["git", "log", "-1", "--pretty=format:%cn", commit_sha],
+        encoding="utf-8",
+        capture_output=True,
+        check=True,
+        cwd=repo_dir,
+    )
+    return commit.stdout.strip()
+
+
+def get_parent_and_committer(repo_dir, commit_sha):
+    """Return the first parent of the commit (None for a root commit) and its committer name."""
+    commit = subprocess.run(
+        ["git", "log", "-1", "--pretty=format:%P%x00%cn", commit_sha],
+        encoding="utf-8",
+        capture_output=True,
+        check=True,
+        cwd=repo_dir,
+    )
+    parents, committer_name = commit.stdout.split("\0", 1)
+    parents = parents.split()
+    return (parents[0] if parents else None), committer_name.strip()
+
+
+def count_diff_lines(repo_dir, commit_sha):
+    """
+    Count the lines added and deleted by the commit relative to its first parent.
+    Only files of a recognised language are counted, the same way as in count_commit_loc.
+    Returns the parent sha, the committer name and the added and deleted line counts.
+    """
+    parent_sha, committer_name = get_parent_and_committer(repo_dir, commit_sha)
+
+    result = subprocess.run(
+        [
+            "git",
+            "diff-tree",
+            "-r",
+            "-z",
+            "--numstat",
+            "--no-renames",
+            parent_sha or EMPTY_TREE_SHA,
+            commit_sha,
+        ],
+        capture_output=True,
+        check=True,
+        cwd=repo_dir,
+    )
+
+    adds = 0
+    deletes = 0
+    for entry in result.stdout.split(b"\0"):
+        if not entry:
+            continue
+        added, deleted, path = entry.split(b"\t", 2)
+        # Binary files are reported as "-"
+        if added == b"-" or deleted == b"-":
+            continue
+        if detect_language(path.decode("utf-8", errors="surrogateescape")):
+            adds += int(added)
+            deletes += int(deleted)
+
+    return parent_sha, committer_name, adds, deletes
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import time
+
+"""
+Persistent cache for the availability checks of the repository fetcher.
+Entries are keyed by the repository URL and hold the HTTP status, the redirect target,
+whether the repository is archived, the ETag of the response and when the URL was checked.
+Entries older than ttl seconds are stale and get checked again, and when the cache holds
+more than max_entries entries the least recently used ones are evicted.
+"""
+
+
+class HttpStatusCache:
+    def __init__(self, path, ttl, max_entries=100000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS http_status (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                archived INTEGER,
+                redirect TEXT,
+                etag TEXT,
+                checked_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS http_status_last_used ON http_status (last_used)"
+        )
+        self.connection.commit()
+
+    def get(self, url):
+        """
+        Return the cached entry {"url", "status", "archived", "redirect", "etag", "checked_at"}
+        of the URL, or None if the URL has not been checked.
+        """
+        row = self.connection.execute(
+            """SELECT status, archived, redirect, etag, checked_at FROM http_status
+            WHERE url = ?""",
+            (url,),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        self.connection.execute(
+            "UPDATE http_status SET last_used = ? WHERE url = ?", (time.time(), url)
+        )
+        status, archived, redirect, etag, checked_at = row
+        return {
+            "url": url,
+            "status": status,
+            "archived": None if archived is None else bool(archived),
+            "redirect": redirect,
+            "etag": etag,
+            "checked_at": checked_at,
+        }
+
+    def is_fresh(self, entry):
+        return entry is not None and time.time() - entry["checked_at"] < self.ttl
+
+    def put(self, record):
+        """Store the result of a check, record is an availability record with an optional "etag"."""
+        now = time.time()
+        self.connection.execute(
+            """INSERT OR REPLACE INTO http_status
+            (url, status, archived, redirect, etag, checked_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (
+                record["url"],
+                record["status"],
+                record["archived"],
+                record["redirect"],
+                record.get("etag"),
+                now,
+                now,
+            ),
+        )
+
+    def refresh(self, url):
+        """Mark the entry as checked now, when the server says it has not changed."""
+        now = time.time()
+        self.connection.execute(
+            "UPDATE http_status SET checked_at = ?, last_used = ? WHERE url = ?",
+            (now, now, url),
+        )
+
+    def close(self):
+        self.__evict()
+        self.connection.commit()
+        self.connection.close()
+
+    def __evict(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM http_status").fetchone()
+        excess = count - self.max_entries
+
+        if excess > 0:
+            self.connection.execute(
+                """DELETE FROM http_status WHERE rowid IN (
+                    SELECT rowid FROM http_status ORDER BY last_used LIMIT ?
+                )""",
+                (excess,),
+            )
@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+from itertools import islice
+
+"""
+Writes fetched issues to disk page by page, as JSON lines, so a project's issues are never held
+in memory as a whole. With compress every page is appended as its own gzip member, which gzip
+readers read as one stream. After every page a resume marker <file>.progress records where the
+next page starts and how many bytes of the file are complete. If a fetch is interrupted the
+marker stays, and the next fetch truncates away a partially written page and continues from the
+recorded position. The marker is removed when the fetch is finished.
+The fetchers list the issues in a stable ascending order, resume with the last written page
+again so that nothing is skipped if issues were removed meanwhile, and drop the duplicates
+with dedupe_issues once finished.
+"""
+
+ISSUES_PER_BATCH = 1000
+
+
+def get_issues_path(base_path, compress=False):
+    return f"{base_path}.jsonl.gz" if compress else f"{base_path}.jsonl"
+
+
+def read_issues(path, compress=False):
+    """Yield the issues of a file written by IssueWriter."""
+    with (gzip.open(path, "rt") if compress else open(path, "r")) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def dedupe_issues(path, compress=False, key="id"):
+    """Keep only the last written version of every issue, returns the number of duplicates."""
+    last_index = {}
+    count = 0
+    for count, issue in enumerate(read_issues(path, compress), start=1):
+        last_index[issue[key]] = count
+    if len(last_index) == count:
+        return 0
+
+    issues = (
+        issue
+        for index, issue in enumerate(read_issues(path, compress), start=1)
+        if last_index[issue[key]] == index
+    )
+    with IssueWriter(f"{path}.tmp", compress).open(resume=False) as writer:
+        writer.write_all(issues)
+        writer.finish()
+    os.replace(f"{path}.tmp", path)
+    return count - len(last_index)
+
+
+class IssueWriter:
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        self.marker_path = f"{path}.progress"
+        self.marker = self.__load_marker()
+        self.file = None
+
+    def __load_marker(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.marker_path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def __save_marker(self):
+        with open(f"{self.marker_path}.tmp", "w") as file:
+            json.dump(self.marker, file)
+        os.replace(f"{self.marker_path}.tmp", self.marker_path)
+
+    @property
+    def resume_position(self):
+        """Where the next page starts (page or offset), None if there is nothing to resume."""
+        return self.marker["next"] if self.marker else None
+
+    @property
+    def resume_state(self):
+        """The state saved with the last completed page, see write_page."""
+        return self.marker["state"] if self.marker else {}
+
+    def open(self, resume=True):
+        """Open the file for appending after the last completed page, or start it over."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if resume and self.marker:
+            self.file = open(self.path, "r+b")
+            self.file.truncate(self.marker["size"])
+            self.file.seek(self.marker["size"])
+        else:
+            self.marker = None
+            self.file = open(self.path, "wb")
+        return self
+
+    def write_page(self, issues, next_position, state=None):
+        """
+        Append a page of issues and record next_position as where to resume. The state, a JSON
+        serializable dict, is saved with the marker for the caller to continue with on resume.
+        """
+        data = "".join(f"{json.dumps(issue)}\n" for issue in issues).encode()
+        if self.compress and data:
+            data = gzip.compress(data)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.marker = {"next": next_position, "size": self.file.tell(), "state": state or {}}
+        self.__save_marker()
+
+    def write_all(self, issues):
+        """Write the issues in batches, for writing a whole file at once."""
+        issues = iter(issues)
+        while batch := list(islice(issues, ISSUES_PER_BATCH)):
+            self.write_page(batch, None)
+
+    def finish(self):
+        self.close()
+        if os.path.exists(self.marker_path):
+            os.remove(self.marker_path)
+        self.marker = None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Closing keeps the marker, so an interrupted fetch can be resumed
+        self.close()
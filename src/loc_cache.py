@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+"""
+Persistent cache for the LOC counts of commits, shared across TLOC runs.
+Entries are keyed by (repository, commit sha, counter version) and hold the committer name
+and the LOC per language of the commit. When the cache holds more than max_entries entries
+the least recently used ones are evicted.
+"""
+
+
+class LocCache:
+    def __init__(self, path, max_entries=1000000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        # Used from the TLOC worker threads, access is serialized with the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS commit_loc (
+                repository TEXT NOT NULL,
+                sha TEXT NOT NULL,
+                counter_version INTEGER NOT NULL,
+                committer TEXT NOT NULL,
+                loc_per_language TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (repository, sha, counter_version)
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS commit_loc_last_used ON commit_loc (last_used)"
+        )
+        self.connection.commit()
+
+    def get(self, repository, sha, counter_version):
+        """Return (committer, loc per language) or None if the commit has not been counted."""
+        with self.lock:
+            row = self.connection.execute(
+                """SELECT committer, loc_per_language FROM commit_loc
+                WHERE repository = ? AND sha = ? AND counter_version = ?""",
+                (repository, sha, counter_version),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self.connection.execute(
+                """UPDATE commit_loc SET last_used = ?
+                WHERE repository = ? AND sha = ? AND counter_version = ?""",
+                (time.time(), repository, sha, counter_version),
+            )
+            self.__count_write()
+
+        return row[0], json.loads(row[1])
+
+    def put(self, repository, sha, counter_version, committer, loc_per_language):
+        with self.lock:
+            self.connection.execute(
+                """INSERT OR REPLACE INTO commit_loc
+                (repository, sha, counter_version, committer, loc_per_language, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (
+                    repository,
+                    sha,
+                    counter_version,
+                    committer,
+                    json.dumps(loc_per_language),
+                    time.time(),
+                ),
+            )
+            self.__count_write()
+
+    def close(self):
+        with self.lock:
+            self.__evict()
+            self.connection.commit()
+            self.connection.close()
+
+    def __count_write(self):
+        # Committing every write would make the cache slower than counting
+        self.pending_writes += 1
+        if self.pending_writes >= 1000:
+            self.__evict()
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def __evict(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM commit_loc").fetchone()
+        excess = count - self.max_entries
+
+        if excess > 0:
+            self.connection.execute(
+                """DELETE FROM commit_loc WHERE rowid IN (
+                    SELECT rowid FROM commit_loc ORDER BY last_used LIMIT ?
+                )""",
+                (excess,),
+            )
@@ -24,6 +24,7 @@ async def main():
     csv_file = config["files"]["csv_file"]
     cloned_repositories_dir = config["paths"]["cloned_repositories_dir"]
     refactoring_miner_exec = config["executables"]["refactoring_miner_exec"]
+    tloc_mode = config.get("tloc", "mode", fallback="snapshot")
 
     timestamp = datetime.now().strftime("%d%m%Y_%H%M%S")
     logging.basicConfig(
@@ -47,6 +48,46 @@ async def main():
     cpus = cpu_count()
     max_procs = max(1, cpus // 2)
     semaphore = asyncio.Semaphore(max_procs)
+    tloc_workers = config.getint("tloc", "workers", fallback=max_procs)
+    fetcher_max_connections = config.getint("fetcher", "max_connections", fallback=10)
+    fetcher_cache_file = config.get(
+        "fetcher", "cache_file", fallback="results/cache/http_status_cache.sqlite"
+    )
+    fetcher_cache_ttl_hours = config.getfloat("fetcher", "cache_ttl_hours", fallback=24)
+    fetcher_cache_max_entries = config.getint(
+        "fetcher", "cache_max_entries", fallback=100000
+    )
+    clone_workers = config.getint("cloner", "workers", fallback=max_procs)
+    clone_mode = config.get("cloner", "mode", fallback="full")
+    shared_objects_dir = config.get("cloner", "shared_objects_dir", fallback="")
+    miner_force = config.getboolean("miner", "force", fallback=False)
+    miner_jvm_heap_mb = config.get("miner", "jvm_heap_mb", fallback="")
+    miner_jvm_heap_mb = int(miner_jvm_heap_mb) if miner_jvm_heap_mb else None
+    miner_chunks = config.getint("miner", "chunks", fallback=1)
+    miner_chunk_min_commits = config.getint(
+        "miner", "chunk_min_commits", fallback=5000
+    )
+    miner_progress_interval = config.getfloat(
+        "miner", "progress_interval", fallback=30
+    )
+    miner_worker_command = config.get("miner", "worker_command", fallback="")
+    miner_workers = config.getint("miner", "workers", fallback=max_procs)
+    issues_concurrency = config.getint("issues", "concurrency", fallback=10)
+    issues_sync = config.getboolean("issues", "sync", fallback=True)
+    issues_metadata_ttl_hours = config.getfloat(
+        "issues", "metadata_ttl_hours", fallback=24
+    )
+    issues_compress = config.getboolean("issues", "compress", fallback=False)
+    pydriller_workers = config.getint("pydriller", "workers", fallback=max_procs)
+    pydriller_backend = config.get("pydriller", "backend", fallback="pydriller")
+    pydriller_output_format = config.get("pydriller", "output_format", fallback="json")
+    pydriller_diff_content = config.get("pydriller", "diff_content", fallback="full")
+    tloc_cache_file = config.get(
+        "tloc", "cache_file", fallback="results/cache/loc_cache.sqlite"
+    )
+    tloc_cache_max_entries = config.getint(
+        "tloc", "cache_max_entries", fallback=1000000
+    )
 
     log_and_print(
         logger,
@@ -56,20 +97,67 @@ async def main():
     )
 
     # Comment / uncomment the rows below based on what you want to do
-    await repository_fetcher.get_repositories(csv_file, semaphore)
+    await repository_fetcher.get_repositories(
+        csv_file,
+        semaphore,
+        fetcher_max_connections,
+        fetcher_cache_file,
+        fetcher_cache_ttl_hours * 60 * 60,
+        fetcher_cache_max_entries,
+    )
     await repository_cloner.clone(
         cloned_repositories_dir,
+        asyncio.Semaphore(clone_workers),
+        clone_mode,
+        shared_objects_dir,
     )
     await refactoring_miner.run_miner(
-        cloned_repositories_dir, refactoring_miner_exec, semaphore
+        cloned_repositories_dir,
+        refactoring_miner_exec,
+        semaphore,
+        miner_force,
+        miner_jvm_heap_mb,
+        miner_chunks,
+        miner_chunk_min_commits,
+        miner_progress_interval,
+        miner_worker_command,
+        miner_workers,
     )
     await refactoring_activity_analyzer.analyze(cloned_repositories_dir, semaphore)
-    repository_pydriller.run_pydriller(cloned_repositories_dir)
-    await refactoring_tlocs.calculate("./results/miner_results")
+    await asyncio.to_thread(
+        repository_pydriller.run_pydriller,
+        cloned_repositories_dir,
+        pydriller_workers,
+        pydriller_backend,
+        pydriller_output_format,
+        pydriller_diff_content,
+    )
+    await refactoring_tlocs.calculate(
+        "./results/miner_results",
+        tloc_mode,
+        tloc_workers,
+        tloc_cache_file,
+        tloc_cache_max_entries,
+    )
 
-    fetch_github_issues.categorize_repos_by_issues_status("./results/repo_lists/ok_repos.txt")
-    await fetch_github_issues.fetch_issues_from_repos_in_file("./results/issues/github_issues_enabled.txt")
-    await fetch_jira_issues.fetch_and_save_issues("./results/issues", "github_issues_disabled.txt")
+    await fetch_github_issues.categorize_repos_by_issues_status(
+        "./results/repo_lists/ok_repos.txt",
+        issues_concurrency,
+        issues_metadata_ttl_hours * 60 * 60,
+    )
+    await fetch_github_issues.fetch_issues_from_repos_in_file(
+        "./results/issues/github_issues_enabled.txt",
+        issues_concurrency,
+        issues_sync,
+        issues_metadata_ttl_hours * 60 * 60,
+        issues_compress,
+    )
+    await asyncio.to_thread(
+        fetch_jira_issues.fetch_and_save_issues,
+        "./results/issues",
+        "github_issues_disabled.txt",
+        issues_compress,
+    )
 
 if __name__ == "__main__":
     asyncio.run(main())
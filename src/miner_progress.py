@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+from util import LogLevel, log_and_print
+
+"""
+Progress of the RefactoringMiner runs. Every "Processing <repo> <sha> ..." line of the miner
+output is turned into an event with the repository, the commit and a timestamp, and a run is
+finished when its process exits. The events give the commits per second and the ETA of every
+repository and of the whole stage, which are printed periodically as one line and written
+to METRICS_FILE.
+"""
+
+METRICS_FILE = "results/miner_metrics.json"
+PROCESSING_PATTERN = re.compile(r"Processing\s.*?\b([0-9a-f]{40})\b")
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def get_eta(remaining, rate):
+    return max(0, remaining) / rate if rate else None
+
+
+class MinerProgress:
+    def __init__(self, metrics_path=METRICS_FILE):
+        self.metrics_path = metrics_path
+        self.started_at = time.time()
+        self.repositories = {}
+
+    def add_run(self, repository, expected_commits):
+        progress = self.repositories.setdefault(
+            repository,
+            {
+                "commits_processed": 0,
+                "commits_expected": 0,
+                "runs": 0,
+                "runs_finished": 0,
+                "first_event_at": None,
+                "last_event_at": None,
+                "last_commit": None,
+            },
+        )
+        progress["commits_expected"] += expected_commits
+        progress["runs"] += 1
+
+    def handle_line(self, repository, line):
+        """Record the event of a miner output line, if it is one."""
+        match = PROCESSING_PATTERN.search(line)
+        if match:
+            self.commit_processed(repository, match.group(1))
+
+    def commit_processed(self, repository, commit):
+        progress = self.repositories[repository]
+        now = time.time()
+        if progress["first_event_at"] is None:
+            progress["first_event_at"] = now
+        progress["last_event_at"] = now
+        progress["last_commit"] = commit
+        progress["commits_processed"] += 1
+
+    def run_finished(self, repository):
+        self.repositories[repository]["runs_finished"] += 1
+
+    def get_metrics(self):
+        now = time.time()
+        repositories = {}
+
+        for repository, progress in self.repositories.items():
+            running_time = (
+                now - progress["first_event_at"] if progress["first_event_at"] else 0
+            )
+            rate = progress["commits_processed"] / running_time if running_time else 0
+            finished = progress["runs_finished"] == progress["runs"]
+            repositories[repository] = {
+                "commits_processed": progress["commits_processed"],
+                "commits_expected": progress["commits_expected"],
+                "commits_per_second": round(rate, 3),
+                "eta_seconds": 0 if finished else get_eta(
+                    progress["commits_expected"] - progress["commits_processed"], rate
+                ),
+                "last_commit": progress["last_commit"],
+                "last_event_at": progress["last_event_at"],
+                "finished": finished,
+            }
+
+        processed = sum(progress["commits_processed"] for progress in repositories.values())
+        expected = sum(progress["commits_expected"] for progress in repositories.values())
+        elapsed = now - self.started_at
+        rate = processed / elapsed if elapsed else 0
+
+        return {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed, 1),
+            "commits_processed": processed,
+            "commits_expected": expected,
+            "commits_per_second": round(rate, 3),
+            "eta_seconds": get_eta(expected - processed, rate),
+            "repositories_finished": sum(
+                progress["finished"] for progress in repositories.values()
+            ),
+            "repositories": repositories,
+        }
+
+    def report(self, logger):
+        """Print one line of progress and write the metrics file."""
+        metrics = self.get_metrics()
+        running = [
+            name
+            for name, progress in metrics["repositories"].items()
+            if not progress["finished"] and progress["commits_processed"]
+        ]
+
+        log_and_print(
+            logger,
+            LogLevel.INFO,
+            f"Mined {metrics['commits_processed']}/{metrics['commits_expected']} commits,"
+            f" {metrics['commits_per_second']:.1f} commits/s,"
+            f" {metrics['repositories_finished']}/{len(metrics['repositories'])} repositories"
+            f" finished, {len(running)} running, ETA {format_duration(metrics['eta_seconds'])}",
+        )
+
+        with open(f"{self.metrics_path}.tmp", "w") as file:
+            json.dump(metrics, file, indent=4)
+        os.replace(f"{self.metrics_path}.tmp", self.metrics_path)
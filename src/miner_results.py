@@ -0,0 +1,143 @@
+import json
+import os
+from itertools import chain
+
+"""
+Streaming reader for the RefactoringMiner JSON outputs in results/miner_results.
+The files look like {"commits": [{"sha1": ..., "refactorings": [...]}, ...]} and can be
+gigabytes in size, so instead of loading the whole file the commits are decoded and
+yielded one at a time. Only the commit being decoded is held in memory.
+"""
+
+CHUNK_SIZE = 1 << 20
+
+
+class JsonStream:
+    """Incremental decoder for a JSON file that is read in chunks."""
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read_more(self):
+        # Drop the part that has already been consumed before growing the buffer
+        self.buffer = self.buffer[self.position :]
+        self.position = 0
+
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer)))
+        if chunk:
+            self.buffer += chunk
+        else:
+            self.eof = True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.eof:
+                raise json.JSONDecodeError("Unexpected end of file", self.buffer, self.position)
+            self.read_more()
+
+    def expect(self, characters):
+        character = self.peek()
+        if character not in characters:
+            raise json.JSONDecodeError(
+                f"Expected one of {characters!r}", self.buffer, self.position
+            )
+        self.position += 1
+        return character
+
+    def decode_value(self):
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A number at the end of the buffer might continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more()
+
+    def iter_array(self):
+        """Decode the array starting at the current position and yield its items one at a time."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.expect("]")
+            return
+
+        while True:
+            yield self.decode_value()
+            if self.expect(",]") == "]":
+                return
+
+
+def iter_commits(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Yield the commits of a RefactoringMiner result file one at a time, in file order.
+    Each commit is the dict RefactoringMiner wrote, with "sha1" and "refactorings",
+    where every refactoring has its "type" and "leftSideLocations"/"rightSideLocations".
+    Raises json.JSONDecodeError if the file is not valid JSON.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        stream = JsonStream(file, chunk_size)
+        stream.expect("{")
+
+        if stream.peek() == "}":
+            return
+
+        while True:
+            key = stream.decode_value()
+            stream.expect(":")
+
+            if key == "commits" and stream.peek() == "[":
+                yield from stream.iter_array()
+            else:
+                stream.decode_value()
+
+            if stream.expect(",}") == "}":
+                return
+
+
+def iter_refactoring_commits(file_path, chunk_size=CHUNK_SIZE):
+    """Yield only the commits that contain at least one refactoring."""
+    for commit in iter_commits(file_path, chunk_size):
+        if commit.get("refactorings"):
+            yield commit
+
+
+def write_commits(commits, file):
+    """Write the commits as a RefactoringMiner result file, one commit per line."""
+    file.write('{"commits": [')
+    for index, commit in enumerate(commits):
+        file.write(",\n" if index else "\n")
+        file.write(json.dumps(commit))
+    file.write("\n]}\n")
+
+
+def merge_results(result_path, new_result_path):
+    """
+    Add the commits of new_result_path before the commits of result_path, which keeps the
+    newest-first order of the file when the new results are for commits mined after it.
+    A commit in both files is taken from the new results. The merged file is written next to
+    result_path and renamed over it, so it is replaced atomically.
+    """
+    new_shas = {commit["sha1"] for commit in iter_commits(new_result_path)}
+    commits = chain(
+        iter_commits(new_result_path),
+        (commit for commit in iter_commits(result_path) if commit["sha1"] not in new_shas),
+    )
+
+    with open(f"{result_path}.tmp", "w", encoding="utf-8") as file:
+        write_commits(commits, file)
+    os.replace(f"{result_path}.tmp", result_path)
@@ -0,0 +1,102 @@
+import os
+import re
+import statistics
+import subprocess
+
+"""
+Cost and memory estimates for scheduling the RefactoringMiner runs.
+The cost of a job is the number of commits it mines times the seconds per commit recorded
+for the repository on its last full run, the rate of a short commit range would mostly be
+the JVM startup. Repositories without a full run use the median of the recorded rates,
+scaled by how large their commits are compared to the other repositories (pack size per
+commit). Every job is a JVM, so the number of jobs running at
+the same time is also limited by the available memory divided by the memory of one JVM.
+"""
+
+DEFAULT_SECONDS_PER_COMMIT = 1.0
+# Metaspace, thread stacks and the JIT come on top of the heap
+JVM_MEMORY_OVERHEAD = 1.25
+# The order the RefactoringMiner start script passes the options in, the last -Xmx wins
+JVM_OPTION_VARIABLES = ("JAVA_TOOL_OPTIONS", "JAVA_OPTS", "REFACTORING_MINER_OPTS")
+MEMORY_UNITS = {"": 1 / (1 << 20), "k": 1 / 1024, "m": 1, "g": 1024, "t": 1 << 20}
+
+
+def read_meminfo_mb(field):
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                name, _, value = line.partition(":")
+                if name == field:
+                    return int(value.split()[0]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_jvm_heap_mb():
+    """Maximum heap of a RefactoringMiner JVM from -Xmx, or the JVM default of 1/4 of the RAM."""
+    heap_mb = None
+    for variable in JVM_OPTION_VARIABLES:
+        for value, unit in re.findall(r"-Xmx(\d+)([kKmMgGtT]?)", os.getenv(variable, "")):
+            heap_mb = int(int(value) * MEMORY_UNITS[unit.lower()])
+
+    if heap_mb is None:
+        total_mb = read_meminfo_mb("MemTotal")
+        heap_mb = total_mb // 4 if total_mb else None
+    return heap_mb
+
+
+def get_max_concurrent_jobs(jvm_heap_mb=None):
+    """How many JVMs fit in the available memory, None if the memory is unknown."""
+    jvm_heap_mb = jvm_heap_mb or get_jvm_heap_mb()
+    available_mb = read_meminfo_mb("MemAvailable")
+    if not jvm_heap_mb or available_mb is None:
+        return None
+    return max(1, int(available_mb // (jvm_heap_mb * JVM_MEMORY_OVERHEAD)))
+
+
+def count_commits(repository_path, revisions):
+    result = subprocess.run(
+        ["git", "-C", repository_path, "rev-list", "--count", *revisions],
+        capture_output=True,
+        text=True,
+    )
+    return int(result.stdout) if result.returncode == 0 else 0
+
+
+def get_pack_size(repository_path):
+    """Size of the object database in bytes, packed and loose objects."""
+    result = subprocess.run(
+        ["git", "-C", repository_path, "count-objects", "-v"],
+        capture_output=True,
+        text=True,
+    )
+    sizes = dict(line.split(": ") for line in result.stdout.splitlines() if ": " in line)
+    return (int(sizes.get("size-pack", 0)) + int(sizes.get("size", 0))) * 1024
+
+
+def estimate_costs(jobs):
+    """
+    Set "estimated_seconds" of every job. A job is a dict with "commits", "pack_size",
+    "total_commits" and "seconds_per_commit", which is None if the repository has no
+    recorded full run.
+    """
+    recorded_rates = [job["seconds_per_commit"] for job in jobs if job["seconds_per_commit"]]
+    default_rate = (
+        statistics.median(recorded_rates) if recorded_rates else DEFAULT_SECONDS_PER_COMMIT
+    )
+
+    commit_sizes = [
+        job["pack_size"] / job["total_commits"] for job in jobs if job["total_commits"]
+    ]
+    median_commit_size = statistics.median(commit_sizes) if commit_sizes else 0
+
+    for job in jobs:
+        rate = job["seconds_per_commit"]
+        if not rate:
+            scale = 1.0
+            if median_commit_size and job["total_commits"]:
+                commit_size = job["pack_size"] / job["total_commits"]
+                scale = min(4.0, max(0.5, commit_size / median_commit_size))
+            rate = default_rate * scale
+        job["estimated_seconds"] = job["commits"] * rate
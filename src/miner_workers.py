@@ -0,0 +1,154 @@
+import asyncio
+import json
+
+from util import LogLevel, log_and_print
+
+"""
+Long-lived RefactoringMiner workers, so that the JVM is started and warmed up once per worker
+instead of once per repository. A worker is started with the configured worker command and
+speaks a line-based protocol:
+
+- Jobs are read from stdin, one JSON object per line: {"id": <int>, "args": [...]}, where args
+  are the RefactoringMiner command line arguments of the job, eg. ["-a", <repo>, "-json", <file>].
+  The results are written to the -json file as a RefactoringMiner process would write them.
+- The miner log of the job, including the "Processing <repo> <sha> ..." lines, goes to stderr.
+- When the job is finished the worker writes {"id": <int>, "returncode": <int>} on one line to
+  stdout, where 0 means success. Anything else on stdout is ignored.
+- The worker exits when stdin is closed.
+
+Jobs are run one at a time per worker. RefactoringMinerWorker.java is the worker, which loads
+RefactoringMiner once and mines every job in the same JVM. stub_miner_worker.py is a stand-in for
+testing that follows the protocol by running the RefactoringMiner executable for every job.
+If a worker can't be started or dies, its slot in the pool falls back to starting one process
+per job.
+"""
+
+
+class MinerWorker:
+    def __init__(self, command, logger, progress):
+        self.command = command
+        self.logger = logger
+        self.progress = progress
+        self.proc = None
+        self.stderr_reader = None
+        self.repository = None
+        self.next_id = 0
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_shell(
+            self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self.stderr_reader = asyncio.create_task(self.__read_stderr())
+
+    async def __read_stderr(self):
+        line = await self.proc.stderr.readline()
+
+        while line:
+            line_content = line.decode(errors="replace").strip()
+            if self.repository is not None:
+                self.progress.handle_line(self.repository, line_content)
+            self.logger.debug(line_content)
+
+            line = await self.proc.stderr.readline()
+
+    async def run(self, args, repository):
+        """Run one job, returns its return code or None if the worker has died."""
+        self.next_id += 1
+        job_id = self.next_id
+        self.repository = repository
+
+        try:
+            self.proc.stdin.write(f"{json.dumps({'id': job_id, 'args': args})}\n".encode())
+            await self.proc.stdin.drain()
+
+            while True:
+                line = await self.proc.stdout.readline()
+                if not line:
+                    return None
+                try:
+                    response = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(response, dict) and response.get("id") == job_id:
+                    return response.get("returncode", 1)
+        except (BrokenPipeError, ConnectionResetError):
+            return None
+        finally:
+            self.repository = None
+
+    async def close(self):
+        if self.proc.returncode is None:
+            self.proc.stdin.close()
+            await self.proc.wait()
+        await self.stderr_reader
+
+
+class MinerWorkerPool:
+    """
+    A fixed number of slots, each holding an idle worker or None when the slot has fallen back
+    to one process per job. acquire() waits for a free slot.
+    """
+
+    def __init__(self, command, size, logger, progress):
+        self.command = command
+        self.size = size
+        self.logger = logger
+        self.progress = progress
+        self.slots = asyncio.Queue()
+        self.workers = []
+
+    async def start(self):
+        for _ in range(self.size):
+            worker = MinerWorker(self.command, self.logger, self.progress)
+            try:
+                await worker.start()
+                self.workers.append(worker)
+                self.slots.put_nowait(worker)
+            except OSError as e:
+                log_and_print(
+                    self.logger,
+                    LogLevel.WARNING,
+                    f"Could not start a miner worker, using one process per job instead: {e}",
+                )
+                self.slots.put_nowait(None)
+
+        log_and_print(
+            self.logger,
+            LogLevel.INFO,
+            f"Started {len(self.workers)} long-lived RefactoringMiner workers",
+        )
+
+    async def acquire(self):
+        return await self.slots.get()
+
+    def release(self, worker):
+        self.slots.put_nowait(worker)
+
+    async def run(self, args, repository, name):
+        """
+        Run a job on a free worker. Returns the return code, or None if the slot has no worker
+        (anymore) and the job has to be run as a separate process.
+        """
+        worker = await self.acquire()
+        if worker is None:
+            self.release(None)
+            return None
+
+        returncode = await worker.run(args, repository)
+        if returncode is None:
+            log_and_print(
+                self.logger,
+                LogLevel.WARNING,
+                f"Miner worker exited while mining {name}, using one process per job in its slot",
+            )
+            await worker.close()
+            worker = None
+
+        self.release(worker)
+        return returncode
+
+    async def close(self):
+        await asyncio.gather(*(worker.close() for worker in self.workers))
@@ -1,65 +1,75 @@
-import aiofiles
 import asyncio
 import json
 import logging
+import numpy as np
 import os
-import re
-import subprocess
-from aiohttp import ClientSession
-from datetime import datetime
 from pathlib import Path
 
+import miner_results
 from util import LogLevel, log_and_print
 
 
+def collect_commit_types(file):
+    types = {}
+    shas = []
+    # Distinct refactoring types of each commit in shas
+    commit_types = []
+
+    for commit in miner_results.iter_commits(file):
+        types_in_commit = set()
+        for refactoring in commit.get("refactorings", []):
+            commit_type = refactoring.get("type")
+            if commit_type:
+                types_in_commit.add(commit_type)
+                if commit_type in types:
+                    types[commit_type] += 1
+                else:
+                    types[commit_type] = 1
+
+        sha = commit.get("sha1")
+        if sha and commit.get("refactorings"):
+            shas.append(sha)
+            commit_types.append(sorted(types_in_commit))
+
+    return types, shas, commit_types
+
+
 async def count_commit_types(file, logger, semaphore):
     try:
         async with semaphore:
-            async with aiofiles.open(file, "r") as f:
-                repo_name = Path(file).stem
-                file_content = await f.read()
-                data = json.loads(file_content)
-                if data:
-                    types = {}
-                    shas = []
-
-                    log_and_print(
-                        logger,
-                        LogLevel.INFO,
-                        f"Collecting RepositoryMiner data from {repo_name}...",
-                    )
-
-                    for commit in data["commits"]:
-                        for refactoring in commit.get("refactorings", []):
-                            commit_type = refactoring.get("type")
-                            if commit_type:
-                                if commit_type in types:
-                                    types[commit_type] += 1
-                                else:
-                                    types[commit_type] = 1
-
-                        sha = commit.get("sha1")
-                        if sha:
-                            shas.append(sha)
-
-                    sorted_types = [
-                        {"type": commit_type, "count": count}
-                        for commit_type, count in sorted(
-                            types.items(), key=lambda item: item[1], reverse=True
-                        )
-                    ]
-
-                    log_and_print(
-                        logger,
-                        LogLevel.INFO,
-                        f"Found {len(sorted_types)} different refactoring types from {repo_name}",
-                    )
-
-                    return {
-                        "repository": repo_name,
-                        "refactoring_types": sorted_types,
-                        "shas": shas,
-                    }
+            repo_name = Path(file).stem
+
+            log_and_print(
+                logger,
+                LogLevel.INFO,
+                f"Collecting RepositoryMiner data from {repo_name}...",
+            )
+
+            # The result file is streamed in a worker thread to keep memory bounded
+            # and the event loop free
+            types, shas, commit_types = await asyncio.to_thread(
+                collect_commit_types, file
+            )
+
+            sorted_types = [
+                {"type": commit_type, "count": count}
+                for commit_type, count in sorted(
+                    types.items(), key=lambda item: item[1], reverse=True
+                )
+            ]
+
+            log_and_print(
+                logger,
+                LogLevel.INFO,
+                f"Found {len(sorted_types)} different refactoring types from {repo_name}",
+            )
+
+            return {
+                "repository": repo_name,
+                "refactoring_types": sorted_types,
+                "shas": shas,
+                "commit_types": commit_types,
+            }
 
     except json.JSONDecodeError:
         log_and_print(logger, LogLevel.ERROR, f"{file} is invalid JSON, skipping")
@@ -74,49 +84,120 @@ async def count_commit_types(file, logger, semaphore):
         return {}
 
 
-async def get_avg_inter_refactoring_times(
-    session, commit_ids, repo_name, cloned_repositories_dir
-):
+async def build_commit_time_index(repo_path):
+    """Stream `git log` once and map every commit sha to its commit timestamp."""
+    proc = await asyncio.create_subprocess_exec(
+        "git",
+        "-C",
+        repo_path,
+        "log",
+        "--pretty=format:%H %ct",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+
+    index = {}
+    async for line in proc.stdout:
+        sha, _, timestamp = line.decode().strip().partition(" ")
+        if timestamp:
+            index[sha] = int(timestamp)
+
+    await proc.wait()
+    return index
+
+
+async def get_refactoring_commit_times(commit_ids, repo_name, cloned_repositories_dir):
+    """Return the commit timestamps of the given commits, -1 for commits not found in git log."""
     path = os.path.join(cloned_repositories_dir, repo_name)
+    commit_times = await build_commit_time_index(path)
 
-    sp_result = subprocess.run(
-        ["git", "-C", path, "log", "--pretty=format:%H %cd"],
-        capture_output=True,
-        text=True,
+    return np.fromiter(
+        (commit_times.get(id, -1) for id in commit_ids),
+        dtype=np.int64,
+        count=len(commit_ids),
     )
 
-    git_log_commits = sp_result.stdout
-    git_log_iter = git_log_commits.splitlines()
-    dates = []
-
-    # Check whether the commit matches with a commit
-    # recognized as a refactoring
-    for id in commit_ids:
-        for line in git_log_iter:
-            if id in line:
-                date = re.sub(r"^[^ ]* ", "", line)
-                dates.append(date)
 
-    return dates
+def summarize_time_diffs(sorted_times):
+    time_differences = np.diff(sorted_times)
+    summary = {
+        "refactoring_commits": int(sorted_times.size),
+        "intervals": int(time_differences.size),
+    }
+
+    if time_differences.size == 0:
+        for key in ("mean", "median", "p90", "min", "max"):
+            summary[f"{key}_seconds"] = None
+        return summary
+
+    median, p90 = np.percentile(time_differences, [50, 90])
+    summary["mean_seconds"] = float(time_differences.mean())
+    summary["median_seconds"] = float(median)
+    summary["p90_seconds"] = float(p90)
+    summary["min_seconds"] = int(time_differences.min())
+    summary["max_seconds"] = int(time_differences.max())
+    return summary
+
+
+def calculate_time_diff_stats(times, commit_types):
+    """
+    Summarize the time between consecutive refactoring commits, in seconds.
+    times holds the commit timestamps (-1 if unknown) and commit_types the refactoring
+    types of each commit. The per type breakdown comes from the same sort: the
+    (type, timestamp) pairs are sorted once by type and time, after which the
+    intervals of every type are a contiguous slice of a single np.diff.
+    """
+    found = times >= 0
+    stats = summarize_time_diffs(np.sort(times[found]))
+
+    types_per_commit = np.fromiter(
+        (len(types) for types in commit_types), dtype=np.int64, count=len(commit_types)
+    )
+    pair_times = np.repeat(times, types_per_commit)
+    pair_found = np.repeat(found, types_per_commit)
+    pair_types = np.array(
+        [commit_type for types in commit_types for commit_type in types], dtype=object
+    )
 
+    by_type = {}
+    if pair_types.size > 0:
+        type_names, type_codes = np.unique(pair_types, return_inverse=True)
+        pair_times = pair_times[pair_found]
+        type_codes = type_codes[pair_found]
 
-def calculate_avg_time_diff(times):
-    time_differences = []
-    datetime_objects = [datetime.strptime(t, "%a %b %d %H:%M:%S %Y %z") for t in times]
+        order = np.lexsort((pair_times, type_codes))
+        sorted_times = pair_times[order]
+        sorted_codes = type_codes[order]
 
-    for index in range(len(datetime_objects) - 1):
-        diff = (datetime_objects[index + 1] - datetime_objects[index]).total_seconds()
-        time_differences.append(diff)
+        codes, starts, counts = np.unique(
+            sorted_codes, return_index=True, return_counts=True
+        )
+        for code, start, count in zip(codes, starts, counts):
+            by_type[str(type_names[code])] = summarize_time_diffs(
+                sorted_times[start : start + count]
+            )
 
-    if len(time_differences) > 0:
-        avg = abs(sum(time_differences) / len(time_differences))
+    stats["by_type"] = by_type
+    return stats
 
-        days = int(avg // 86400)
-        hours = int(avg // 3600)
 
-        return f"{hours} hours, which is ~{days} days"
+async def add_inter_refactoring_times(
+    repository, cloned_repositories_dir, semaphore
+):
+    shas = repository.pop("shas")
+    commit_types = repository.pop("commit_types")
+
+    async with semaphore:
+        times = await get_refactoring_commit_times(
+            shas,
+            repository.get("repository"),
+            cloned_repositories_dir,
+        )
 
-    return "0"
+    if times.size > 0:
+        repository["inter_refactoring_times"] = calculate_time_diff_stats(
+            times, commit_types
+        )
 
 
 async def analyze(cloned_repositories_dir, semaphore):
@@ -134,39 +215,35 @@ async def analyze(cloned_repositories_dir, semaphore):
         log_and_print(logger, LogLevel.INFO, "RepositoryMiner results not found")
         return
 
-    async with ClientSession() as session:
-        log_and_print(
-            logger, LogLevel.INFO, "Refactoring Activity Analyzer is starting"
-        )
+    log_and_print(
+        logger, LogLevel.INFO, "Refactoring Activity Analyzer is starting"
+    )
 
-        results = await asyncio.gather(
-            *(count_commit_types(file[0], logger, semaphore) for file in files)
-        )
+    results = await asyncio.gather(
+        *(count_commit_types(file[0], logger, semaphore) for file in files)
+    )
 
-        log_and_print(
-            logger,
-            LogLevel.INFO,
-            "Calculating AVG inter-refactoring times for repositories...",
-        )
+    log_and_print(
+        logger,
+        LogLevel.INFO,
+        "Calculating inter-refactoring times for repositories...",
+    )
 
-        for repository in results:
-            if repository:
-                dates = await get_avg_inter_refactoring_times(
-                    session,
-                    repository.get("shas"),
-                    repository.get("repository"),
-                    cloned_repositories_dir,
-                )
-                if dates:
-                    time_diff = calculate_avg_time_diff(dates)
-                    del repository["shas"]
-                    repository["avg_commit_time_diff"] = time_diff
+    await asyncio.gather(
+        *(
+            add_inter_refactoring_times(
+                repository, cloned_repositories_dir, semaphore
+            )
+            for repository in results
+            if repository
+        )
+    )
 
-        filename = f"{dest_dir}/refactoring_type_results.json"
+    filename = f"{dest_dir}/refactoring_type_results.json"
 
-        with open(filename, "a") as file:
-            file.truncate(0)
-            json.dump(results, file)
+    with open(filename, "a") as file:
+        file.truncate(0)
+        json.dump(results, file)
 
     log_and_print(
         logger,
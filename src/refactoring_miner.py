@@ -1,55 +1,370 @@
 import os
-import re
+import json
+import time
 import asyncio
 import logging
+import subprocess
+from itertools import chain
 
+import miner_progress
+import miner_results
+import miner_scheduler
+import miner_workers
 from util import LogLevel, log_and_print
 
+"""
+Runs RefactoringMiner on the cloned repositories. The HEAD mined last is recorded for every
+repository in STATE_DIR, and on the next run only the commits added since then are mined
+with the commit range mode (-bc) and merged into the existing results. The whole history
+is mined again (-a) when forced, when there are no earlier results or when the history
+has been rewritten so that the last mined commit is no longer an ancestor of HEAD.
+The most expensive repositories are mined first and the number of RefactoringMiner JVMs
+running at the same time is limited by the available memory, see miner_scheduler.
+Large repositories can be split into commit ranges that are mined in parallel and combined.
+A single -a run mines all the remote branches, so the whole history is only chunked when those
+are exactly the commits of HEAD, which the chunks cover.
+The miner output is only written to the debug log, the progress is reported by miner_progress.
+With a worker command the jobs are run on long-lived workers instead, see miner_workers.
+"""
 
-async def __handle_stream(stream, logger, log_level):
+STATE_DIR = "results/miner_results/.state"
+CHUNK_BRANCH = "refactoring-miner-chunk"
+# RefactoringMiner -a <branch> only walks the remote branches
+CHUNK_REF = f"refs/remotes/origin/{CHUNK_BRANCH}"
+
+
+async def __handle_stream(stream, logger, progress, repository):
     line = await stream.readline()
 
     while line:
-        line_content = line.decode().strip()
-
-        if "Processing" in line_content:
-            stripped_line = re.search(r"([^\/]*$)", line_content)
-            if stripped_line:
-                repo_and_commit = stripped_line.group(0).rstrip("...").strip()
-                hash = re.search(r"\b[0-9a-f]{40}\b", repo_and_commit)
-                if hash:
-                    log_and_print(logger, log_level, f"Mining commit {repo_and_commit}")
-        elif "Analyzed" in line_content:
-            finished_repository = re.sub(r"^.*Analyzed\s", "", line_content)
-            log_and_print(logger, log_level, f"Finished mining {finished_repository}")
-        else:
-            if "Total count:" not in line_content:
-                log_and_print(logger, log_level, line.decode().strip())
+        line_content = line.decode(errors="replace").strip()
+        progress.handle_line(repository, line_content)
+        logger.debug(line_content)
 
         line = await stream.readline()
 
 
-async def run_subcommand(cmd_with_name, logger, semaphore):
+async def run_subcommand(cmd_with_name, logger, progress, repository):
     cmd, name = cmd_with_name
 
-    async with semaphore:
-        proc = await asyncio.create_subprocess_shell(
-            cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
+    proc = await asyncio.create_subprocess_shell(
+        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+
+    log_and_print(logger, LogLevel.INFO, f"Mining {name}")
+
+    await asyncio.gather(
+        __handle_stream(proc.stdout, logger, progress, repository),
+        # Miner seems to direct output to stderr instead of stdout
+        __handle_stream(proc.stderr, logger, progress, repository),
+    )
+
+    await proc.wait()
+    progress.run_finished(repository)
+    log_and_print(logger, LogLevel.INFO, f"Finished mining {name}")
+    return proc.returncode
+
+
+def load_state(repo_name):
+    try:
+        with open(f"{STATE_DIR}/{repo_name}.json", "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_state(repo_name, state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    state_path = f"{STATE_DIR}/{repo_name}.json"
+    with open(f"{state_path}.tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(f"{state_path}.tmp", state_path)
+
+
+def get_repository_head(repository_path):
+    result = subprocess.run(
+        ["git", "-C", repository_path, "rev-parse", "HEAD"],
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def is_ancestor(repository_path, commit, head):
+    result = subprocess.run(
+        ["git", "-C", repository_path, "merge-base", "--is-ancestor", commit, head],
+        capture_output=True,
+    )
+    return result.returncode == 0
+
+
+def plan_repository(dir_path, dir_name, force):
+    """
+    Decide how the repository is mined: "unchanged" if HEAD has already been mined, "range"
+    for the commits added since the last run or "full" for the whole history.
+    Returns the job with the inputs of the cost estimate, see miner_scheduler.estimate_costs.
+    """
+    result_path = f"results/miner_results/{dir_name}.json"
+    head = get_repository_head(dir_path)
+    state = load_state(dir_name) or {}
+    last_mined = state.get("last_mined")
+
+    job = {
+        "path": dir_path,
+        "name": dir_name,
+        "head": head,
+        "last_mined": last_mined,
+        "kind": "full",
+        "seconds_per_commit": state.get("seconds_per_commit"),
+    }
+
+    if not force and last_mined and head and os.path.exists(result_path):
+        if last_mined == head:
+            job["kind"] = "unchanged"
+            return job
+        if is_ancestor(dir_path, last_mined, head):
+            job["kind"] = "range"
+
+    job["total_commits"] = miner_scheduler.count_commits(dir_path, ["--all"])
+    job["commits"] = (
+        miner_scheduler.count_commits(dir_path, [f"{last_mined}..{head}"])
+        if job["kind"] == "range"
+        else job["total_commits"]
+    )
+    job["pack_size"] = miner_scheduler.get_pack_size(dir_path)
+    return job
+
+
+def get_chunk_ends(repository_path, start, head, chunks):
+    """
+    Split the first-parent history from start (exclusive, None for the root) to head
+    into at most chunks ranges of the same length and return the last commit of every range.
+    """
+    revisions = ["--first-parent", "--reverse", head] + ([f"^{start}"] if start else [])
+    result = subprocess.run(
+        ["git", "-C", repository_path, "rev-list", *revisions],
+        capture_output=True,
+        text=True,
+    )
+    first_parents = result.stdout.split()
+    chunks = max(1, min(chunks, len(first_parents)))
+
+    ends = [first_parents[len(first_parents) * index // chunks - 1] for index in range(1, chunks)]
+    return ends + [head]
+
+
+def get_remote_branches(repository_path):
+    """Tips of the remote branches that RefactoringMiner -a mines, by ref name."""
+    result = subprocess.run(
+        [
+            "git",
+            "-C",
+            repository_path,
+            "for-each-ref",
+            "--format=%(refname) %(objectname)",
+            "refs/remotes/origin/",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    branches = dict(line.split() for line in result.stdout.splitlines())
+    for ref in ("refs/remotes/origin/HEAD", CHUNK_REF):
+        branches.pop(ref, None)
+    return branches
+
+
+def mines_only_head(repository_path, head):
+    """
+    Whether a single -a run, which walks all the remote branches, mines exactly the commits
+    of HEAD. The sets are the same when both have as many commits as their union.
+    """
+    tips = list(get_remote_branches(repository_path).values())
+    if not tips:
+        return False
+    head_commits = miner_scheduler.count_commits(repository_path, [head])
+    return (
+        miner_scheduler.count_commits(repository_path, tips) == head_commits
+        and miner_scheduler.count_commits(repository_path, tips + [head]) == head_commits
+    )
+
+
+def new_run(executable, args, name, output_path):
+    return {
+        "command": f"{executable} {' '.join(args)}",
+        "args": args,
+        "name": name,
+        "output_path": output_path,
+    }
+
+
+def get_runs(job, executable, chunks, chunk_min_commits):
+    """
+    Return the RefactoringMiner runs of the job, oldest commits first. Each run is a dict with
+    the shell "command", its RefactoringMiner "args", a "name" for the log and the "output_path"
+    the results are written to.
+    Jobs of at least chunk_min_commits commits are split into chunks commit ranges, which
+    RefactoringMiner mines in separate processes at the same time.
+    """
+    logger = logging.getLogger("miner_logger")
+    dir_path = job["path"]
+    result_path = f"results/miner_results/{job['name']}.json"
+    last_mined = job["last_mined"] if job["kind"] == "range" else None
+
+    # A chunk ref left behind by an interrupted run would be mined by a single -a run too
+    subprocess.run(["git", "-C", dir_path, "update-ref", "-d", CHUNK_REF], capture_output=True)
+
+    ends = None
+    if chunks >= 2 and job["commits"] >= chunk_min_commits and job["head"]:
+        if job["kind"] == "full" and not mines_only_head(dir_path, job["head"]):
+            log_and_print(
+                logger,
+                LogLevel.INFO,
+                f"Not chunking {job['name']}, a single run mines remote branches other than HEAD",
+            )
+        else:
+            # The ranges between the chunk ends are consecutive, so together they have
+            # exactly the commits from last_mined to HEAD
+            ends = get_chunk_ends(dir_path, last_mined, job["head"], chunks)
+
+    if ends is None:
+        if job["kind"] == "range":
+            # Written next to the result file, without the .json extension
+            # so that the other stages don't pick them up
+            output_path = f"{result_path}.new"
+            args = ["-bc", dir_path, last_mined, job["head"], "-json", output_path]
+            name = f"{job['name']} ({last_mined[:7]}..{job['head'][:7]})"
+        else:
+            # Mined into a temporary file, so a failed run never replaces the earlier results
+            output_path = f"{result_path}.tmp"
+            args = ["-a", dir_path, "-json", output_path]
+            name = job["name"]
+        return [new_run(executable, args, name, output_path)]
+
+    runs = []
+    start = last_mined
+    for index, end in enumerate(ends):
+        output_path = f"{result_path}.chunk{index}"
+        if start is None:
+            # The oldest chunk has no start commit, it is mined with -a up to a temporary
+            # remote branch, which is the only kind of branch -a mines
+            subprocess.run(
+                ["git", "-C", dir_path, "update-ref", CHUNK_REF, end],
+                capture_output=True,
+                check=True,
+            )
+            args = ["-a", dir_path, CHUNK_BRANCH, "-json", output_path]
+        else:
+            args = ["-bc", dir_path, start, end, "-json", output_path]
+
+        name = f"{job['name']} ({start[:7] if start else 'root'}..{end[:7]})"
+        runs.append(new_run(executable, args, name, output_path))
+        start = end
+    return runs
+
+
+async def run_on_worker(run, worker_pool, logger, progress):
+    """Return the return code of the run, or None if it has to be run as a separate process."""
+    log_and_print(logger, LogLevel.INFO, f"Mining {run['name']} on a worker")
+    returncode = await worker_pool.run(run["args"], run["repository"], run["name"])
+
+    if returncode is not None:
+        progress.run_finished(run["repository"])
+        log_and_print(logger, LogLevel.INFO, f"Finished mining {run['name']}")
+    return returncode
+
+
+async def run_chunk(run, logger, semaphore, memory_semaphore, progress, worker_pool):
+    """Return the return code and the running time of a RefactoringMiner run."""
+    async with semaphore, memory_semaphore:
+        start = time.monotonic()
+        returncode = None
+        if worker_pool is not None:
+            returncode = await run_on_worker(run, worker_pool, logger, progress)
+        if returncode is None:
+            returncode = await run_subcommand(
+                (run["command"], run["name"]), logger, progress, run["repository"]
+            )
+        return returncode, time.monotonic() - start
+
+
+async def report_progress(progress, logger, interval):
+    while True:
+        await asyncio.sleep(interval)
+        progress.report(logger)
+
+
+def combine_chunks(output_paths, combined_path):
+    """Combine the results of the chunks, newest chunk first like the results of a single run."""
+    commits = chain.from_iterable(
+        miner_results.iter_commits(path) for path in reversed(output_paths)
+    )
+    with open(combined_path, "w", encoding="utf-8") as file:
+        miner_results.write_commits(commits, file)
+
+
+async def mine_repository(job, run_tasks):
+    """Wait for the runs of the job and update its results. Return "mined", "updated" or "failed"."""
+    dir_name = job["name"]
+    result_path = f"results/miner_results/{dir_name}.json"
+    output_paths = [run["output_path"] for run in job["runs"]]
 
-        log_and_print(logger, LogLevel.INFO, f"Mining {name}")
+    results = await asyncio.gather(*run_tasks)
 
-        await asyncio.gather(
-            __handle_stream(proc.stdout, logger, LogLevel.INFO),
-            # Miner seems to direct output to stderr instead of stdout
-            __handle_stream(proc.stderr, logger, LogLevel.INFO),
+    if len(job["runs"]) > 1:
+        subprocess.run(
+            ["git", "-C", job["path"], "update-ref", "-d", CHUNK_REF],
+            capture_output=True,
         )
 
-        await proc.wait()
-        return proc.returncode
+    if any(returncode != 0 for returncode, _ in results):
+        for path in output_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        return "failed"
 
+    if len(output_paths) > 1:
+        output_path = f"{result_path}.new" if job["kind"] == "range" else f"{result_path}.tmp"
+        await asyncio.to_thread(combine_chunks, output_paths, output_path)
+        for path in output_paths:
+            os.remove(path)
+    else:
+        output_path = output_paths[0]
+
+    if job["kind"] == "range":
+        await asyncio.to_thread(miner_results.merge_results, result_path, output_path)
+        os.remove(output_path)
+    else:
+        os.replace(output_path, result_path)
+
+    if job["head"]:
+        # The rate of a full run is the estimate for the next ones. The JVM startup dominates
+        # a short -bc range, so range runs keep the rate of the last full run
+        seconds_per_commit = job["seconds_per_commit"]
+        if job["kind"] == "full":
+            elapsed = sum(seconds for _, seconds in results)
+            seconds_per_commit = elapsed / max(1, job["commits"])
+        save_state(
+            dir_name,
+            {
+                "last_mined": job["head"],
+                "seconds_per_commit": seconds_per_commit,
+            },
+        )
+    return "updated" if job["kind"] == "range" else "mined"
 
-async def run_miner(repo_path, executable, semaphore):
+
+async def run_miner(
+    repo_path,
+    executable,
+    semaphore,
+    force=False,
+    jvm_heap_mb=None,
+    chunks=1,
+    chunk_min_commits=5000,
+    progress_interval=30,
+    worker_command="",
+    workers=0,
+):
     logger = logging.getLogger("miner_logger")
     dest_dir = "results/miner_results"
     os.makedirs(dest_dir, exist_ok=True)
@@ -58,30 +373,72 @@ async def run_miner(repo_path, executable, semaphore):
         (f.path, f.name) for f in (os.scandir(repo_path)) if f.is_dir()
     ]
 
-    commands_and_names = []
+    plans = await asyncio.gather(
+        *(
+            asyncio.to_thread(plan_repository, dir_path, dir_name, force)
+            for dir_path, dir_name in repository_directories
+        )
+    )
 
-    for dir_path, dir_name in repository_directories:
-        command = (
-            f"{executable} -a {dir_path} -json results/miner_results/{dir_name}.json"
+    jobs = [job for job in plans if job["kind"] != "unchanged"]
+    unchanged_repositories = len(plans) - len(jobs)
+    for job in plans:
+        if job["kind"] == "unchanged":
+            log_and_print(logger, LogLevel.INFO, f"{job['name']} has no new commits to mine")
+
+    miner_scheduler.estimate_costs(jobs)
+    progress = miner_progress.MinerProgress()
+    runs = []
+    for job in jobs:
+        job["runs"] = await asyncio.to_thread(
+            get_runs, job, executable, chunks, chunk_min_commits
         )
-        commands_and_names.append((command, dir_name))
+        for run in job["runs"]:
+            run["repository"] = job["name"]
+            run["estimated_seconds"] = job["estimated_seconds"] / len(job["runs"])
+            progress.add_run(job["name"], round(job["commits"] / len(job["runs"])))
+            runs.append(run)
+
+    max_jobs = miner_scheduler.get_max_concurrent_jobs(jvm_heap_mb)
+    if max_jobs is not None:
+        log_and_print(
+            logger,
+            LogLevel.INFO,
+            f"The available memory fits {max_jobs} RefactoringMiner processes at a time",
+        )
+    memory_semaphore = asyncio.Semaphore(max_jobs or max(1, len(runs)))
+
+    worker_pool = None
+    if worker_command and workers > 0 and runs:
+        worker_pool = miner_workers.MinerWorkerPool(
+            worker_command, min(workers, max_jobs or workers), logger, progress
+        )
+        await worker_pool.start()
+
+    # Longest runs first, so a large repository doesn't start last and keep the stage running.
+    # The tasks wait for the semaphores in the order they are created
+    for run in sorted(runs, key=lambda run: run["estimated_seconds"], reverse=True):
+        run["task"] = asyncio.create_task(
+            run_chunk(run, logger, semaphore, memory_semaphore, progress, worker_pool)
+        )
+    reporter = asyncio.create_task(report_progress(progress, logger, progress_interval))
 
     tasks = [
-        asyncio.create_task(run_subcommand(command, logger, semaphore))
-        for command in commands_and_names
+        asyncio.create_task(mine_repository(job, [run["task"] for run in job["runs"]]))
+        for job in jobs
     ]
 
-    total_commands = len(commands_and_names)
-    successful_commands = 0
+    total_commands = len(plans)
+    successful_commands = unchanged_repositories
     failed_commands = 0
 
     for future in asyncio.as_completed(tasks):
         result = await future
 
-        if result == 0:
-            successful_commands += 1
-        else:
+        if result == "failed":
             failed_commands += 1
+        else:
+            successful_commands += 1
 
         if successful_commands > 0:
             log_and_print(
@@ -97,8 +454,15 @@ async def run_miner(repo_path, executable, semaphore):
                 f"{failed_commands} minings failed of total {total_commands}",
             )
 
+    reporter.cancel()
+    progress.report(logger)
+    if worker_pool is not None:
+        await worker_pool.close()
+
     log_and_print(
         logger,
         LogLevel.INFO,
-        f"Refactoring miner is finished\nMiner results are in {dest_dir} directory",
+        f"Refactoring miner is finished, {unchanged_repositories} repositories had no new commits"
+        f"\nMiner results are in {dest_dir} directory"
+        f"\nMining metrics are in {progress.metrics_path}",
     )
@@ -1,8 +1,15 @@
+import asyncio
 import subprocess
 import os
 import json
 import configparser
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import git_loc
+import miner_results
+from loc_cache import LocCache
 
 """
 This module is responsible for calculating the touched lines of code for each refactoring and each developer effort. Task E in the project handout
@@ -12,8 +19,16 @@ config.read("config.ini")
 cloned_repositories_dir = config["paths"]["cloned_repositories_dir"]
 dest_dir = "results/tloc_results"
 
-async def calculate(refactoring_results_dir: str):
+# "snapshot" subtracts the LOC of the previous commit from the LOC of the refactoring commit,
+# "diff" sums the lines added and deleted in the parent -> commit diff
+TLOC_MODES = ("snapshot", "diff")
+
+async def calculate(refactoring_results_dir: str, mode: str = "snapshot", workers: int = 1,
+                    cache_file: str = "results/cache/loc_cache.sqlite", cache_max_entries: int = 1000000):
     print("developer effort calculation")
+    if mode not in TLOC_MODES:
+        print(f"Unknown TLOC mode {mode}, expected one of {', '.join(TLOC_MODES)}")
+        return
     os.makedirs(dest_dir, exist_ok=True)
     
     files = [
@@ -25,37 +40,57 @@ async def calculate(refactoring_results_dir: str):
     if len(files) < 1:
         print("Refactoring results not found")
         return
-    for index,file in enumerate(files):
-        print(f"Processing file {index + 1} of {len(files)}")
-        await process_file(file[0], file[1])
+    
+    workers = max(1, workers)
+    print(f"Calculating TLOCs with {workers} workers")
+    
+    # Commits are counted by a shared pool of worker threads. The counting reads the git
+    # object database only, so several repositories and several commits of one repository
+    # can be processed at the same time without separate checkouts.
+    semaphore = asyncio.Semaphore(workers)
+    # LOC counts of commits survive between runs, so only commits never seen before are counted
+    loc_cache = LocCache(cache_file, cache_max_entries)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            
+            async def process_file_with_limit(index, file):
+                async with semaphore:
+                    print(f"Processing file {index + 1} of {len(files)}")
+                    await process_file(file[0], file[1], mode, executor, loc_cache)
+            
+            try:
+                await asyncio.gather(
+                    *(process_file_with_limit(index, file) for index, file in enumerate(files))
+                )
+            except BaseException:
+                # The jobs still running use the cache, so they are finished and the queued
+                # ones dropped before the cache is closed
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        loc_cache.close()
         
     
     
-async def process_file(file_path : str, file_name : str):
+async def process_file(file_path : str, file_name : str, mode : str = "snapshot", executor : ThreadPoolExecutor = None, loc_cache : LocCache = None):
     
     repository_name = file_name.replace(".json", "")
     
     print(f"Processing file: {file_path}")
 
-    with open(file_path, "r", encoding="utf-8") as file:
-        refactoring_results = json.load(file)
-        
-    commits = refactoring_results["commits"]
-    commit_results = []
-    for index, commit in enumerate(commits):
-        if len(commit["refactorings"]) == 0:
-            continue
-        if index + 1 < len(commits):
-            try:
-                prev_commit = commits[index + 1]
-                if prev_commit is None:
-                    print(f"Could not find previous commit for {commit['sha1']} in repository {repository_name}")
-                    continue
-                commiter_name, tlocs = get_commit_tloc_info(repository_name, commit["sha1"], commits[index + 1]["sha1"]) 
-                # TLOC per commit
-                commit_results.append({"commit": commit["sha1"], "prev_commit":  prev_commit['sha1'], "commiter": commiter_name, "tlocs": tlocs})
-            except ValueError as e:
-                print(f"Error calculating TLOCs for commit {commit['sha1']} in repository {repository_name}: {e}")
+    # Line counts per blob, shared by all commits of the repository
+    blob_cache = {}
+    jobs = await asyncio.to_thread(collect_commit_pairs, file_path, mode)
+    
+    # gather keeps the order of the jobs, so the output is the same as in a serial run
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(
+        *(
+            loop.run_in_executor(executor, process_refactoring_commit, repository_name, commit_sha, prev_commit_sha, mode, blob_cache, loc_cache)
+            for commit_sha, prev_commit_sha in jobs
+        )
+    )
+    commit_results = [result for result in results if result is not None]
             
     if len(commit_results) == 0:
         print(f"Was unable to calculate refactorings for: {repository_name}")
@@ -67,7 +102,10 @@ async def process_file(file_path : str, file_name : str):
             committer = commit["commiter"]
             tlocs = commit["tlocs"]
             
-            if tlocs > 0:
+            if "adds" in commit:
+                contributor_stats[committer]["adds"] += commit["adds"]
+                contributor_stats[committer]["deletes"] += commit["deletes"]
+            elif tlocs > 0:
                 contributor_stats[committer]["adds"] += tlocs
             else:
                 contributor_stats[committer]["deletes"] += abs(tlocs)
@@ -88,47 +126,87 @@ async def process_file(file_path : str, file_name : str):
                         "contributors": contributors}, file)
 
     
-def process_commit(repository_name: str, commit_sha: str):
-    repo_dir = os.path.join(cloned_repositories_dir, repository_name)
-    lock_file = os.path.join(repo_dir, ".git", "index.lock")
+def collect_commit_pairs(file_path: str, mode: str) -> list:
+    """
+    Stream the miner results and pair each refactoring commit with the commit that follows it
+    in the file. Only the sha pairs are kept in memory, not the refactorings themselves.
+    """
+    jobs = []
+    commit = None
+    # None marks the end of the file, the last commit has no following commit
+    for next_commit in chain(miner_results.iter_commits(file_path), [None]):
+        if commit is not None and len(commit["refactorings"]) > 0:
+            if mode == "diff":
+                # Diff mode compares the commit with its parent instead
+                jobs.append((commit["sha1"], None))
+            elif next_commit is not None:
+                jobs.append((commit["sha1"], next_commit["sha1"]))
+        commit = next_commit
+    
+    return jobs
+
+    
+def process_refactoring_commit(repository_name: str, commit_sha: str, prev_commit_sha: str, mode: str, blob_cache: dict, loc_cache: LocCache = None):
+    try:
+        if mode == "diff":
+            return get_commit_diff_tloc_info(repository_name, commit_sha)
+        
+        commiter_name, tlocs = get_commit_tloc_info(repository_name, commit_sha, prev_commit_sha, blob_cache, loc_cache)
+        # TLOC per commit
+        return {"commit": commit_sha, "prev_commit": prev_commit_sha, "commiter": commiter_name, "tlocs": tlocs}
+    except ValueError as e:
+        print(f"Error calculating TLOCs for commit {commit_sha} in repository {repository_name}: {e}")
+
     
-    if os.path.exists(lock_file):
-        os.remove(lock_file)
+def process_commit(repository_name: str, commit_sha: str, blob_cache: dict = None, loc_cache: LocCache = None):
+    repo_dir = os.path.join(cloned_repositories_dir, repository_name)
     
+    # Reads the commit straight from the object database, so the working tree is
+    # never checked out and other stages can use the same clone at the same time
     try:
-        subprocess.run(["git", "checkout", "-f", commit_sha], check=True, cwd=repo_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        commit = subprocess.run(["git", "log", "-1", "--pretty=format:%cn" , commit_sha], encoding="utf-8", capture_output=True, text=True, check=True, cwd=repo_dir)
-        committer_name = commit.stdout.strip()
-        result = subprocess.run(["scc", "--no-cocomo", "--no-complexity", "--no-size"], encoding="utf-8",  capture_output=True, text=True, cwd=repo_dir)
-        # Parse the scc output to get the LOC
-        loc = 0
-        for line in result.stdout.splitlines():
-            parts = line.split()
-            if (len(parts) > 1 and parts[0] == "Total"):
-                loc = int(parts[2])
+        cached = loc_cache.get(repository_name, commit_sha, git_loc.COUNTER_VERSION) if loc_cache else None
+        if cached:
+            committer_name, loc_per_language = cached
+        else:
+            committer_name = git_loc.get_committer_name(repo_dir, commit_sha)
+            loc_per_language = git_loc.count_commit_loc(repo_dir, commit_sha, blob_cache)
+            if loc_cache:
+                loc_cache.put(repository_name, commit_sha, git_loc.COUNTER_VERSION, committer_name, loc_per_language)
+        loc = sum(loc_per_language.values())
                     
         return committer_name, loc
     
     except subprocess.CalledProcessError as e:
-        print(f"Error checking out commit {commit_sha} in repository {repository_name}: {e}")
+        print(f"Error reading commit {commit_sha} in repository {repository_name}: {e}")
     except OSError as e:
-        if e.errno == 36:  # Filename too long
-            print(f"Error: Filename too long in repository {repository_name} for commit {commit_sha}")
+        print(f"Error reading commit {commit_sha} in repository {repository_name}: {e}")
 
     
     
 
-def get_commit_tloc_info(repository_name: str, rc_commit_sha: str, prev_commit_sha: str) -> tuple:
+def get_commit_tloc_info(repository_name: str, rc_commit_sha: str, prev_commit_sha: str, blob_cache: dict = None, loc_cache: LocCache = None) -> tuple:
     
     if rc_commit_sha == prev_commit_sha:
         raise ValueError("RC and previous commit SHAs must be different")
     
-    refactored_commit = process_commit(repository_name, rc_commit_sha)
-    prev_commit = process_commit(repository_name, prev_commit_sha)
+    refactored_commit = process_commit(repository_name, rc_commit_sha, blob_cache, loc_cache)
+    prev_commit = process_commit(repository_name, prev_commit_sha, blob_cache, loc_cache)
     
     if refactored_commit is None or prev_commit is None:
         raise ValueError("Could not calculate LOC for one of the commits")
     
     tloc = refactored_commit[1] - prev_commit[1]
     
-    return refactored_commit[0], tloc
\ No newline at end of file
+    return refactored_commit[0], tloc
+
+
+def get_commit_diff_tloc_info(repository_name: str, commit_sha: str) -> dict:
+    repo_dir = os.path.join(cloned_repositories_dir, repository_name)
+    
+    try:
+        parent_sha, committer_name, adds, deletes = git_loc.count_diff_lines(repo_dir, commit_sha)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise ValueError(f"Could not diff the commit: {e}")
+    
+    return {"commit": commit_sha, "prev_commit": parent_sha, "commiter": committer_name,
+            "tlocs": adds + deletes, "adds": adds, "deletes": deletes}
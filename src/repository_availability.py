@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from aiohttp import ClientError, ClientTimeout
+
+from util import LogLevel, log_and_print
+
+"""
+Checks whether GitHub repositories are available. Repositories are resolved in batches of up to
+100 per GitHub GraphQL query, which also tells whether a repository is archived or has been
+renamed/transferred. Repositories GraphQL can't resolve, or every repository when no
+GITHUB_TOKEN is set, are checked with lightweight HEAD requests with exponential backoff.
+"""
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+GRAPHQL_BATCH_SIZE = 100
+MAX_RETRIES = 5
+MAX_RETRY_DELAY = 300
+# GitHub answers these when it is overloaded or rate limiting
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+
+logger = logging.getLogger("repository_availability_logger")
+
+
+def parse_github_url(url):
+    """Return (owner, name) of a https://github.com/<owner>/<name> or git@github.com:<owner>/<name> URL."""
+    path = url.strip().removeprefix("https://github.com/").removeprefix("git@github.com:")
+    owner, name = path.strip("/").split("/")[:2]
+    return owner, name.removesuffix(".git")
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header, which is either seconds or an HTTP date."""
+    try:
+        return max(0, int(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff_delay(attempt, response=None):
+    delay = None
+    if response is not None and "Retry-After" in response.headers:
+        delay = parse_retry_after(response.headers["Retry-After"])
+    if delay is None:
+        delay = 2**attempt
+    return min(delay, MAX_RETRY_DELAY)
+
+
+def build_repositories_query(repositories, fields):
+    aliases = [
+        f"r{index}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ {fields} }}"
+        for index, (owner, name) in enumerate(repositories)
+    ]
+    return "query {\n" + "\n".join(aliases) + "\nrateLimit { cost remaining resetAt }\n}"
+
+
+async def wait_for_rate_limit(rate_limit):
+    """Sleep until the rate limit resets if the next query could exceed it."""
+    if not rate_limit or rate_limit["remaining"] > 2 * rate_limit["cost"]:
+        return
+
+    reset_at = datetime.fromisoformat(rate_limit["resetAt"].replace("Z", "+00:00"))
+    delay = max(0, reset_at.timestamp() - time.time()) + 1
+    log_and_print(
+        logger,
+        LogLevel.WARNING,
+        f"GraphQL rate limit almost used up, waiting {int(delay)} seconds",
+    )
+    await asyncio.sleep(delay)
+
+
+async def query_repository_batch(session, token, repositories, fields):
+    """
+    Resolve one batch of (owner, name) pairs. Returns a dict (owner, name) -> repository fields,
+    where repositories that don't exist map to None and ones that could not be resolved are left out.
+    """
+    query = build_repositories_query(repositories, fields)
+    headers = {"Authorization": f"token {token}"}
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with session.post(
+                GRAPHQL_URL,
+                json={"query": query},
+                headers=headers,
+                timeout=ClientTimeout(total=120),
+            ) as response:
+                if response.status in RETRY_STATUSES:
+                    await asyncio.sleep(get_backoff_delay(attempt, response))
+                    continue
+                if response.status != 200:
+                    log_and_print(
+                        logger,
+                        LogLevel.WARNING,
+                        f"GraphQL query failed with {response.status}",
+                    )
+                    return {}
+                result = await response.json()
+        except (ClientError, asyncio.TimeoutError):
+            await asyncio.sleep(get_backoff_delay(attempt))
+            continue
+
+        data = result.get("data") or {}
+        not_found = {
+            error["path"][0]
+            for error in result.get("errors", [])
+            if error.get("type") == "NOT_FOUND" and error.get("path")
+        }
+
+        resolved = {}
+        for index, repository in enumerate(repositories):
+            alias = f"r{index}"
+            if data.get(alias) is not None:
+                resolved[repository] = data[alias]
+            elif alias in not_found:
+                resolved[repository] = None
+
+        await wait_for_rate_limit(data.get("rateLimit"))
+        return resolved
+
+    return {}
+
+
+async def query_repositories(session, token, repositories, fields, semaphore):
+    """Resolve (owner, name) pairs in batches of GRAPHQL_BATCH_SIZE, see query_repository_batch."""
+    repositories = list(dict.fromkeys(repositories))
+    batches = [
+        repositories[index : index + GRAPHQL_BATCH_SIZE]
+        for index in range(0, len(repositories), GRAPHQL_BATCH_SIZE)
+    ]
+
+    async def query_batch(batch):
+        async with semaphore:
+            return await query_repository_batch(session, token, batch, fields)
+
+    resolved = {}
+    for batch_result in await asyncio.gather(*(query_batch(batch) for batch in batches)):
+        resolved.update(batch_result)
+    return resolved
+
+
+async def head_status(session, url, semaphore, etag=None):
+    """
+    Check a single repository page with a HEAD request, retrying with exponential backoff.
+    With an etag the request is conditional and the status is 304 if the page has not changed.
+    """
+    record = {"url": url, "status": None, "archived": None, "redirect": None, "etag": None}
+    headers = {"If-None-Match": etag} if etag else {}
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with semaphore:
+                async with session.head(
+                    url,
+                    allow_redirects=False,
+                    headers=headers,
+                    timeout=ClientTimeout(total=60),
+                ) as response:
+                    if response.status in RETRY_STATUSES - {403}:
+                        delay = get_backoff_delay(attempt, response)
+                    else:
+                        record["status"] = response.status
+                        record["etag"] = response.headers.get("ETag")
+                        if response.status in (301, 302, 307, 308):
+                            record["redirect"] = response.headers.get("Location")
+                        return record
+        except (ClientError, asyncio.TimeoutError) as error:
+            log_and_print(logger, LogLevel.DEBUG, f"Request failed for {url}: {error}")
+            delay = get_backoff_delay(attempt)
+
+        await asyncio.sleep(delay)
+
+    record["status"] = 408
+    return record
+
+
+def to_availability_record(url, repository):
+    owner, name = parse_github_url(url)
+    if repository is None:
+        return {"url": url, "status": 404, "archived": None, "redirect": None}
+
+    renamed = repository["nameWithOwner"].lower() != f"{owner}/{name}".lower()
+    return {
+        "url": url,
+        "status": 301 if renamed else 200,
+        "archived": repository["isArchived"],
+        "redirect": repository["url"] if renamed else None,
+    }
+
+
+async def check_availability(session, urls, token, semaphore, etags=None):
+    """
+    Return a record {"url", "status", "archived", "redirect"} for every URL, in the order of urls.
+    The status is 200 for available repositories, 301 for renamed or transferred ones
+    (redirect holds the new URL), 404 for missing ones and 408 if the check kept failing.
+    Records of HEAD requests also have the "etag" of the response. etags maps URLs to the ETag
+    of an earlier check, those URLs are checked with conditional HEAD requests and get the
+    status 304 if they have not changed.
+    """
+    etags = etags or {}
+    records = {}
+
+    # URLs with an ETag from an earlier HEAD check are revalidated with a conditional request
+    graphql_urls = [url for url in urls if url not in etags]
+
+    if token and graphql_urls:
+        resolved = await query_repositories(
+            session,
+            token,
+            [parse_github_url(url) for url in graphql_urls],
+            "nameWithOwner url isArchived",
+            semaphore,
+        )
+        for url in graphql_urls:
+            repository_key = parse_github_url(url)
+            if repository_key in resolved:
+                records[url] = to_availability_record(url, resolved[repository_key])
+
+        log_and_print(
+            logger,
+            LogLevel.INFO,
+            f"Resolved {len(records)}/{len(graphql_urls)} repositories with GraphQL",
+        )
+
+    fallback_urls = [url for url in urls if url not in records]
+    for record in await asyncio.gather(
+        *(head_status(session, url, semaphore, etags.get(url)) for url in fallback_urls)
+    ):
+        records[record["url"]] = record
+
+    return [records[url] for url in urls]
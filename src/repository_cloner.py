@@ -1,15 +1,31 @@
 import asyncio
 import logging
+import os
 
+import shared_object_store
 from util import LogLevel, log_and_print
 
+"""
+Clones the repositories listed in results/repo_lists/ok_repos.txt into the cloned repositories
+directory. Repositories that have already been cloned are updated with git fetch instead, and
+checked out at the tip of the default branch.
+The mode selects what is downloaded:
+full     - a normal clone with a working tree
+blobless - a partial clone (--filter=blob:none), file contents are fetched when they are needed
+bare     - a clone without a working tree, for the stages that only read git objects
+With a shared objects directory, related clones share their objects, see shared_object_store.
+"""
+
+CLONE_MODES = ("full", "blobless", "bare")
+REPOSITORY_LIST = "results/repo_lists/ok_repos.txt"
+
 
 async def run_subcommand(
     cmd,
     logger,
 ):
-    proc = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
 
     try:
@@ -29,46 +45,140 @@ async def run_subcommand(
     return proc.returncode
 
 
-async def clone(directory):
+def read_repository_urls(filepath):
+    with open(filepath, "r") as file:
+        # Older repository lists have a stray quote at the end of every line
+        urls = [line.strip().rstrip("'") for line in file]
+    return [url for url in urls if url]
+
+
+def get_repository_name(url):
+    return url.rstrip("/").split("/")[-1].split(":")[-1].removesuffix(".git")
+
+
+def get_clone_command(url, destination, mode, reference_stores=()):
+    cmd = ["git", "clone"]
+    if mode == "blobless":
+        cmd.append("--filter=blob:none")
+    elif mode == "bare":
+        cmd.append("--bare")
+    for store in reference_stores:
+        cmd.append(f"--reference-if-able={store}")
+    return cmd + [url, destination]
+
+
+def get_update_commands(destination):
+    if not os.path.isdir(os.path.join(destination, ".git")):
+        # A bare clone has no fetch refspec, so the branches are updated explicitly. They are
+        # fetched as remote branches too, which are the only branches RefactoringMiner -a mines
+        return [
+            [
+                "git",
+                "-C",
+                destination,
+                "fetch",
+                "--prune",
+                "origin",
+                "+refs/heads/*:refs/heads/*",
+                "+refs/heads/*:refs/remotes/origin/*",
+            ]
+        ]
+
+    # HEAD may be detached, eg. after checking out a mined commit, so instead of merging into
+    # the current branch the clone is checked out at the tip of the default branch
+    return [
+        ["git", "-C", destination, "fetch", "--prune"],
+        ["git", "-C", destination, "remote", "set-head", "origin", "--auto"],
+        ["git", "-C", destination, "checkout", "--force", "--detach", "origin/HEAD"],
+    ]
+
+
+async def clone_or_update(url, destination, mode, reference_stores, logger, semaphore):
+    """Return "cloned", "updated" or "failed"."""
+    async with semaphore:
+        if not os.path.exists(destination):
+            returncode = await run_subcommand(
+                get_clone_command(url, destination, mode, reference_stores), logger
+            )
+            if returncode != 0:
+                return "failed"
+            if mode == "bare":
+                # A bare clone gets the remote branches with the first update
+                for cmd in get_update_commands(destination):
+                    if await run_subcommand(cmd, logger) != 0:
+                        return "failed"
+            return "cloned"
+
+        for cmd in get_update_commands(destination):
+            if await run_subcommand(cmd, logger) != 0:
+                return "failed"
+        return "updated"
+
+
+async def clone(directory, semaphore, mode="full", shared_objects_dir=""):
     logger = logging.getLogger("cloner_logger")
-    clone_commands = []
 
-    with open("results/repo_lists/ok_repos.txt", "r") as file:
-        repositories = file.readlines()
+    if mode not in CLONE_MODES:
+        log_and_print(
+            logger,
+            LogLevel.ERROR,
+            f"Unknown clone mode {mode!r}, expected one of {', '.join(CLONE_MODES)}",
+        )
+        return
 
-        # Matti: range(0, 87)
-        # Kristian: range(88, 179)
-        # Arttu: range(180, 269)
-        # Walter: range(270, len(repositories) -1)
-        for index in range(88, 179):
-            command = f"git -C {directory} clone {repositories[index]}"
-            clone_commands.append(command)
+    os.makedirs(directory, exist_ok=True)
+    repository_urls = read_repository_urls(REPOSITORY_LIST)
+    destinations = {
+        url: os.path.join(directory, get_repository_name(url)) for url in repository_urls
+    }
+
+    # Partial clones can't share objects
+    share_objects = bool(shared_objects_dir) and mode != "blobless"
+    store_index = (
+        shared_object_store.load_index(shared_objects_dir) if share_objects else {}
+    )
 
-    count_of_clone_ops = len(clone_commands)
     log_and_print(
-        logger, LogLevel.INFO, f"Starting cloning {count_of_clone_ops} repositories"
+        logger,
+        LogLevel.INFO,
+        f"Starting cloning {len(repository_urls)} repositories ({mode} clones)",
     )
 
     tasks = [
-        asyncio.create_task(run_subcommand(command, logger))
-        for command in clone_commands
+        asyncio.create_task(
+            clone_or_update(
+                url,
+                destinations[url],
+                mode,
+                shared_object_store.get_reference_stores(
+                    url, shared_objects_dir, store_index
+                ),
+                logger,
+                semaphore,
+            )
+        )
+        for url in repository_urls
     ]
 
-    successful_clones = 0
-    failed_clones = 0
+    results = {"cloned": 0, "updated": 0, "failed": 0}
 
     for future in asyncio.as_completed(tasks):
         result = await future
+        results[result] += 1
 
-        if result == 0:
-            successful_clones += 1
-        else:
-            failed_clones += 1
+    if share_objects:
+        await shared_object_store.update_shared_stores(
+            {destination: url for url, destination in destinations.items()},
+            shared_objects_dir,
+            semaphore,
+            logger,
+        )
 
     log_and_print(
         logger,
         LogLevel.INFO,
         """Cloner is finished"""
-        f"""\nSuccessfully cloned {successful_clones} repositories """
-        f"""\nFailed to clone {failed_clones} repositories """,
+        f"""\nSuccessfully cloned {results['cloned']} repositories """
+        f"""\nUpdated {results['updated']} existing clones """
+        f"""\nFailed to clone or update {results['failed']} repositories """,
     )
@@ -2,36 +2,66 @@ import asyncio
 import logging
 import os
 import pandas as pd
-import re
-from aiohttp import ClientSession, ClientError, ClientTimeout
+from aiohttp import ClientSession, TCPConnector
 
+import repository_availability
+from http_status_cache import HttpStatusCache
 from util import LogLevel, log_and_print
 
 
-def get_github_urls(filename, logger):
-    df = pd.read_csv(filename, low_memory=False, dtype={7: str, 8: str})
-    col_headers = list(df.columns)
-    github_urls = []
+def remove_organization_prefix(pairs, separator):
+    """Remove "<organization><separator>" from the start of the project names, one vectorized call per organization."""
+    projects = pairs["project"].copy()
+    for organization, index in pairs.groupby("organization").groups.items():
+        projects.loc[index] = projects.loc[index].str.removeprefix(
+            f"{organization}{separator}"
+        )
+    return projects
 
-    if "project" in col_headers and "organization" in col_headers:
-        for index, row in df.iterrows():
-            project = row["project"]
-            organization = row["organization"]
 
-            modified_row = (
-                project.removeprefix(f"{organization}_")
+def get_github_urls(filename, logger, chunk_size=100000):
+    col_headers = list(pd.read_csv(filename, nrows=0).columns)
+    # dict keeps the order in which the URLs were first seen
+    github_urls = {}
+    seen_pairs = set()
+    row_count = 0
+
+    if "project" in col_headers and "organization" in col_headers:
+        # Only the two needed columns are read, in chunks, and every distinct
+        # (project, organization) pair is normalised only once
+        for chunk in pd.read_csv(
+            filename,
+            usecols=["project", "organization"],
+            dtype=str,
+            chunksize=chunk_size,
+        ):
+            row_count += len(chunk)
+            pairs = chunk.dropna().drop_duplicates()
+            is_new = [pair not in seen_pairs for pair in zip(pairs["project"], pairs["organization"])]
+            pairs = pairs[is_new]
+            if pairs.empty:
+                continue
+            seen_pairs.update(zip(pairs["project"], pairs["organization"]))
+
+            pairs = pairs.assign(project=remove_organization_prefix(pairs, "_"))
+            pairs = pairs.assign(
+                project=pairs["project"]
                 # replacing some common keywords
-                .replace("-master", "")
-                .replace("-builder", "")
-                .replace("-parent", "")
-                # lastly, remove the organization from the beginning
-                .removeprefix(f"{organization}-")
+                .str.replace("-master", "", regex=False)
+                .str.replace("-builder", "", regex=False)
+                .str.replace("-parent", "", regex=False)
             )
+            # lastly, remove the organization from the beginning
+            pairs = pairs.assign(project=remove_organization_prefix(pairs, "-"))
 
-            url = f"https://github.com/{organization}/{modified_row}"
-            if url not in github_urls:
-                github_urls.append(url)
-                log_and_print(logger, LogLevel.INFO, f"Found URL: {url}")
+            urls = "https://github.com/" + pairs["organization"] + "/" + pairs["project"]
+            github_urls.update(dict.fromkeys(urls))
+
+        log_and_print(
+            logger,
+            LogLevel.INFO,
+            f"Found {len(github_urls)} unique GitHub URLs from {row_count} rows of {filename}",
+        )
     else:
         log_and_print(
             logger,
@@ -39,35 +69,57 @@ def get_github_urls(filename, logger):
             "The source csv file does not contain expected headers 'project' and 'organization'",
         )
 
-    return github_urls
+    return list(github_urls)
 
 
-async def get_http_statuses_for_urls(session, urls, logger, semaphore):
-    tasks = [test_http_status(session, url, logger, semaphore) for url in urls]
-    return await asyncio.gather(*tasks)
+async def get_http_statuses_for_urls(session, urls, logger, semaphore, status_cache):
+    """
+    Return the availability record of every URL, in the order of urls. Only the URLs without
+    a fresh entry in status_cache are checked, and the results are stored in the cache.
+    """
+    cached = {url: status_cache.get(url) for url in urls}
+    stale_urls = [url for url in urls if not status_cache.is_fresh(cached[url])]
 
+    log_and_print(
+        logger,
+        LogLevel.INFO,
+        f"{len(urls) - len(stale_urls)}/{len(urls)} repositories have a fresh cached status,"
+        f" checking {len(stale_urls)} repositories",
+    )
 
-async def test_http_status(session, url, logger, semaphore):
-    try:
-        async with semaphore:
-            async with session.get(url, timeout=ClientTimeout(total=60)) as response:
-                log_and_print(logger, LogLevel.INFO, f"{url} {response.status}")
-                return f"{url} {response.status}"
-
-    except asyncio.TimeoutError:
-        log_and_print(logger, LogLevel.INFO, f"{url} caused timeout")
-        return f"{url} 408"
+    if stale_urls:
+        token = os.getenv("GITHUB_TOKEN")
+        if not token:
+            log_and_print(
+                logger,
+                LogLevel.WARNING,
+                "GITHUB_TOKEN is not set, checking the repositories with HEAD requests",
+            )
 
-    except ClientError as error:
-        log_and_print(logger, LogLevel.INFO, f"Request failed for {url}: {str(error)}")
-        return f"{url} request failed"
+        etags = {
+            url: cached[url]["etag"]
+            for url in stale_urls
+            if cached[url] is not None and cached[url]["etag"]
+        }
+        for record in await repository_availability.check_availability(
+            session, stale_urls, token, semaphore, etags
+        ):
+            if record["status"] == 304:
+                status_cache.refresh(record["url"])
+            elif record["status"] != 408:
+                status_cache.put(record)
+            elif cached[record["url"]] is None:
+                # Failed checks are not cached, they are retried on the next run
+                cached[record["url"]] = record
+
+    return [status_cache.get(url) or cached[url] for url in urls]
 
 
 def write_to_text_file(collection, filepath):
     with open(filepath, "a") as file:
         file.truncate(0)
         for item in collection:
-            file.write(f"{item}'\n")
+            file.write(f"{item}\n")
 
 
 def write_to_text_file_and_print(collection, filepath, header, logger):
@@ -119,7 +171,14 @@ def convert_https_to_ssh(https_urls):
     return ssh_urls
 
 
-async def get_repositories(csv_file, semaphore):
+async def get_repositories(
+    csv_file,
+    semaphore,
+    max_connections=10,
+    cache_file="results/cache/http_status_cache.sqlite",
+    cache_ttl=24 * 60 * 60,
+    cache_max_entries=100000,
+):
     logger = logging.getLogger("repository_fetcher_logger")
     https_urls = get_github_urls(csv_file, logger)
     ssh_urls = convert_https_to_ssh(https_urls)
@@ -128,28 +187,44 @@ async def get_repositories(csv_file, semaphore):
     http_statuses = []
     ok_repos = []
     unavailable_repos = []
+    archived_repos = []
+    redirected_repos = []
 
-    write_to_text_file_and_print(
-        ssh_urls, f"{dest_dir}/ssh_urls.txt", "All repositories:", logger
+    write_to_text_file(ssh_urls, f"{dest_dir}/ssh_urls.txt")
+    log_and_print(
+        logger,
+        LogLevel.INFO,
+        f"\nFound {len(ssh_urls)} repositories, listed in {dest_dir}/ssh_urls.txt",
     )
 
-    # Test the http responses of the github urls, eg. 200, 301, 400
-    async with ClientSession() as session:
-        print("\nHTTP statuses of the repositories:")
-        http_statuses = await get_http_statuses_for_urls(
-            session, https_urls, logger, semaphore
-        )
+    # Test the http responses of the github urls, eg. 200, 301, 404
+    status_cache = HttpStatusCache(cache_file, cache_ttl, cache_max_entries)
+    try:
+        async with ClientSession(
+            connector=TCPConnector(limit=max_connections)
+        ) as session:
+            print("\nChecking the availability of the repositories...")
+            http_statuses = await get_http_statuses_for_urls(
+                session, https_urls, logger, semaphore, status_cache
+            )
+    finally:
+        status_cache.close()
 
-    write_to_text_file(http_statuses, f"{dest_dir}/https_statuses.txt")
+    write_to_text_file(
+        [f"{record['url']} {record['status']}" for record in http_statuses],
+        f"{dest_dir}/https_statuses.txt",
+    )
 
-    # Sort the received http responses to 200 OK and 301/400 NOT OK
-    for status in http_statuses:
-        if "200" in status:
-            stripped_status = re.sub(r" \d+$", "", status)
-            ok_repos.append(stripped_status)
+    # Sort the received http responses to 200 OK and 301/404 NOT OK
+    for record in http_statuses:
+        if record["status"] == 200:
+            ok_repos.append(record["url"])
         else:
-            stripped_status = re.sub(r" \d+$", "", status)
-            unavailable_repos.append(stripped_status)
+            unavailable_repos.append(record["url"])
+        if record["archived"]:
+            archived_repos.append(record["url"])
+        if record["redirect"]:
+            redirected_repos.append(f"{record['url']} -> {record['redirect']}")
 
     write_to_text_file(
         sorted(convert_https_to_ssh(ok_repos), key=str.casefold),
@@ -163,6 +238,20 @@ async def get_repositories(csv_file, semaphore):
         logger,
     )
 
+    write_to_text_file_and_print(
+        sorted(archived_repos, key=str.casefold),
+        f"{dest_dir}/archived_repos.txt",
+        "Archived repositories:",
+        logger,
+    )
+
+    write_to_text_file_and_print(
+        sorted(redirected_repos, key=str.casefold),
+        f"{dest_dir}/redirected_repos.txt",
+        "Renamed or transferred repositories:",
+        logger,
+    )
+
     count_ok = len(ok_repos)
     count_unavailable = len(unavailable_repos)
 
@@ -171,7 +260,8 @@ async def get_repositories(csv_file, semaphore):
         LogLevel.INFO,
         f"""\nRepository fetcher is finished."""
         f"""\nFound {count_ok} OK repositories and"""
-        f""" {count_unavailable} unavailable repositories."""
+        f""" {count_unavailable} unavailable repositories,"""
+        f""" {len(archived_repos)} repositories are archived."""
         f"""\nOk repos are in {dest_dir}/ok_repos.txt"""
         f"""\nUnavailable repos are in {dest_dir}/unavailable_repos.txt""",
     )
@@ -1,14 +1,30 @@
+import hashlib
+import heapq
 import json
 import os
 import logging
+import multiprocessing
+import subprocess
+import textwrap
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pydriller import Repository
 
+import git_diff_stream
+import miner_results
 from util import LogLevel, log_and_print
 
-def pydrill(repository_path, filtered_commits, logger):
-    data = []
-    repo_name = os.path.basename(repository_path.strip('/'))
-    
+# "pydriller" builds the records from PyDriller objects, "git" streams them from one
+# `git diff-tree --stdin` process (see git_diff_stream), which is much faster
+BACKENDS = ("pydriller", "git")
+# "json" is one indented JSON array, "jsonl" has one compact JSON line per commit
+OUTPUT_FORMATS = ("json", "jsonl")
+# "full" keeps the added/deleted lines, "ranges" only their line number ranges, "none" drops them
+DIFF_CONTENT_MODES = ("full", "ranges", "none")
+# Inputs of the last run of each repository, see process_repository
+STATE_DIR = "results/pydriller_results/.state"
+
+def iter_pydriller_commits(repository_path, filtered_commits):
     for commit in Repository(repository_path, only_commits=filtered_commits).traverse_commits():
         commit_data = {
             "commit_hash": commit.hash,
@@ -30,23 +46,137 @@ def pydrill(repository_path, filtered_commits, logger):
             commit_data["diff stats"].append(diff_stats)
             commit_data["diff content"].append(diff_content)
 
-        data.append(commit_data)
+        yield commit_data
+
+def iter_commit_records(repository_path, filtered_commits, backend="pydriller"):
+    if backend == "git":
+        return git_diff_stream.iter_commit_diffs(repository_path, filtered_commits)
+    return iter_pydriller_commits(repository_path, filtered_commits)
+
+def to_line_ranges(lines):
+    """Collapse (line number, line) pairs into [first, last] ranges of consecutive line numbers."""
+    ranges = []
+    for line_number, _ in lines:
+        if ranges and ranges[-1][1] + 1 == line_number:
+            ranges[-1][1] = line_number
+        else:
+            ranges.append([line_number, line_number])
+    return ranges
+
+def shape_record(commit_data, diff_content="full"):
+    if diff_content == "none":
+        del commit_data["diff content"]
+    elif diff_content == "ranges":
+        for entry in commit_data["diff content"]:
+            entry["diff"] = {
+                "added": to_line_ranges(entry["diff"]["added"]),
+                "deleted": to_line_ranges(entry["diff"]["deleted"]),
+            }
+    return commit_data
+
+def write_records(records, file, output_format="json"):
+    """Write the records one at a time as they are produced, returns the count of records written."""
+    count = 0
+    if output_format == "jsonl":
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+            count += 1
+        return count
+    
+    # Same layout as json.dump(records, file, indent=4) without holding all the records
+    for record in records:
+        file.write("[\n" if count == 0 else ",\n")
+        file.write(textwrap.indent(json.dumps(record, indent=4), "    "))
+        count += 1
+    file.write("\n]" if count else "[]")
+    return count
+
+def iter_pydriller_results(result_path):
+    """Iterate the commit records of a result file in either output format without loading it whole."""
+    with open(result_path, "r", encoding="utf-8") as file:
+        if result_path.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from miner_results.JsonStream(file, miner_results.CHUNK_SIZE).iter_array()
+
+def get_result_path(repo_name, output_format="json"):
+    return f"results/pydriller_results/{repo_name}.{output_format}"
+
+def drill_records(repository_path, commits, backend="pydriller", diff_content="full"):
+    return (
+        shape_record(commit_data, diff_content)
+        for commit_data in iter_commit_records(repository_path, commits, backend)
+    )
+
+def merge_records(repository_path, result_path, new_records, filtered_commits):
+    """
+    Merge the records of the result file and the new records into the order of a fresh run
+    (see git_diff_stream.list_commits_in_order), leaving out the commits no longer filtered.
+    """
+    ordered_commits = git_diff_stream.list_commits_in_order(repository_path, filtered_commits)
+    position = {sha: index for index, (sha, _) in enumerate(ordered_commits)}
+    old_records = (
+        record for record in iter_pydriller_results(result_path) if record["commit_hash"] in position
+    )
+    new_records = sorted(
+        (record for record in new_records if record["commit_hash"] in position),
+        key=lambda record: position[record["commit_hash"]],
+    )
+    return heapq.merge(old_records, new_records, key=lambda record: position[record["commit_hash"]])
+
+def pydrill(repository_path, filtered_commits, logger, backend="pydriller", output_format="json", diff_content="full", drilled_commits=None):
+    """
+    Drill the commits and write their records to the result file of the repository.
+    drilled_commits are the commits whose records are already in the result file. Only the other
+    commits are drilled, and their records are merged with the existing ones.
+    Returns the size of the result file.
+    """
+    repo_name = os.path.basename(repository_path.strip('/'))
+    result_path = get_result_path(repo_name, output_format)
+    if drilled_commits is None:
+        records = drill_records(repository_path, filtered_commits, backend, diff_content)
+    else:
+        new_commits = [commit for commit in filtered_commits if commit not in drilled_commits]
+        new_records = drill_records(repository_path, new_commits, backend, diff_content) if new_commits else []
+        records = merge_records(repository_path, result_path, new_records, filtered_commits)
+    
+    # Written next to the result and renamed, so an interrupted run never leaves a partial file
+    with open(f"{result_path}.tmp", "w") as f:
+        write_records(records, f, output_format)
+    os.replace(f"{result_path}.tmp", result_path)
     
     log_and_print(logger, LogLevel.INFO, f"Pydriller finished: {repo_name}")
-    result = f"results/pydriller_results/{repo_name}.json" 
+    return os.path.getsize(result_path)
+
+def get_repository_head(repo_path):
+    result = subprocess.run(["git", "-C", repo_path, "rev-parse", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def hash_commits(commits):
+    return hashlib.sha256("\n".join(sorted(commits)).encode()).hexdigest()
 
-    with open(result, "w") as f:
-        json.dump(data, f, indent=4)
+def load_state(repo_name):
+    try:
+        with open(f"{STATE_DIR}/{repo_name}.json", "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_state(repo_name, state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    state_path = f"{STATE_DIR}/{repo_name}.json"
+    with open(f"{state_path}.tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(f"{state_path}.tmp", state_path)
 
 def get_refactored_commits(repository, logger):
     repository_path = f"results/miner_results/{repository}.json"
     
     try:
-        with open(repository_path, 'r') as file:
-            minerJSON = json.load(file)
-        
         filtered_commits = [
-            commit["sha1"] for commit in minerJSON["commits"] if commit.get("refactorings")
+            commit["sha1"] for commit in miner_results.iter_refactoring_commits(repository_path)
         ]
         return ("OK!", filtered_commits)
 
@@ -62,13 +192,94 @@ def get_refactored_commits(repository, logger):
         log_and_print(logger, LogLevel.ERROR, f"Unexpected error occurred: {e}")
         return ["Error!", f"Unexpected error occurred: {e}"]
     
-def run_pydriller(cloned_repositories_dir):
+def process_repository(repo_path, backend="pydriller", output_format="json", diff_content="full"):
+    """
+    Drill a single repository. Runs in a worker process when run_pydriller uses several workers,
+    so it returns the outcome instead of collecting it and the parent aggregates the summary.
+    
+    The inputs of every run are recorded in a state file: the HEAD of the clone and the refactoring
+    commits that were drilled. If the inputs have not changed since the last run the repository is
+    not drilled again. Otherwise only the commits that are new are drilled, and their records are
+    merged with the existing ones in the order of a fresh run. The records of commits that are no
+    longer refactoring commits are dropped, and the results of a repository that has none left
+    are removed.
+    """
+    logger = logging.getLogger("pydriller_logger")
+    repo_name = os.path.basename(repo_path.strip('/'))
+    result_path = get_result_path(repo_name, output_format)
+    
+    status, filtered_commits = get_refactored_commits(repo_name, logger)
+    
+    if  status in ["Warning!", "Error!"] and filtered_commits:
+        return repo_name, "error", filtered_commits
+    if  status in ["OK!"] and filtered_commits:
+        options = {"backend": backend, "output_format": output_format, "diff_content": diff_content}
+        fingerprint = {"head": get_repository_head(repo_path), "commits": hash_commits(filtered_commits)}
+        state = load_state(repo_name)
+        # The recorded results are only usable if the file is exactly as the last run left it
+        results_intact = (
+            state is not None
+            and "commits" in state
+            and state["options"] == options
+            and os.path.exists(result_path)
+            and os.path.getsize(result_path) == state["output_size"]
+        )
+        
+        if results_intact and state["fingerprint"] == fingerprint:
+            log_and_print(logger, LogLevel.INFO, f"Inputs of {repo_name} have not changed, skipping repository.")
+            return repo_name, "unchanged", None
+        
+        drilled_commits = set(state["commits"]) if results_intact else None
+        log_and_print(logger, LogLevel.INFO, f"Total count of refactored commits in {repo_name}: {len(filtered_commits)}")
+        if drilled_commits is not None:
+            new_count = len(set(filtered_commits) - drilled_commits)
+            log_and_print(logger, LogLevel.INFO, f"Only {new_count} commits are new since the last run of {repo_name}")
+        log_and_print(logger, LogLevel.INFO, f"Pydriller started: {repo_name} ({backend} backend)")
+        try:
+            output_size = pydrill(repo_path, filtered_commits, logger, backend, output_format, diff_content, drilled_commits)
+        except Exception as e:
+            log_and_print(logger, LogLevel.ERROR, f"Pydriller failed for {repo_name}: {e}")
+            return repo_name, "error", f"Pydriller failed: {e}"
+        
+        save_state(repo_name, {
+            "fingerprint": fingerprint,
+            "options": options,
+            "commits": filtered_commits,
+            "output_size": output_size,
+        })
+        return repo_name, "success", None
+    
+    log_and_print(logger, LogLevel.INFO, f"No refactoring detected in {repo_name}, skipping repository.")
+    # Results of an earlier run would be stale
+    for path in (result_path, f"{STATE_DIR}/{repo_name}.json"):
+        if os.path.exists(path):
+            os.remove(path)
+    return repo_name, "skipped", None
+    
+def init_worker_logging(log_files, level):
+    """Spawned workers start without the logging configuration of the parent, so they log to its files."""
+    logging.basicConfig(
+        handlers=[logging.FileHandler(log_file, encoding="utf-8") for log_file in log_files], level=level
+    )
+
+def iter_outcomes(futures):
+    """Outcomes of the repositories as their worker processes finish them."""
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+        except BrokenProcessPool as e:
+            # A crashed worker breaks the pool, which fails the repositories that were not finished
+            repo_name = os.path.basename(futures[future].strip('/'))
+            yield repo_name, "error", f"Pydriller worker process crashed: {e}"
+
+def run_pydriller(cloned_repositories_dir, workers=1, backend="pydriller", output_format="json", diff_content="full"):
     
     logger = logging.getLogger("pydriller_logger")
         
     count = 0
     succesful_repos = []
     skipped_repos = []
+    unchanged_repos = []
     error_repos = []
     
     os.makedirs("results", exist_ok=True)
@@ -82,26 +293,53 @@ def run_pydriller(cloned_repositories_dir):
         log_and_print(logger, LogLevel.WARNING, f"No cloned repositories found in {cloned_repositories_dir}")
         return
     
+    if backend not in BACKENDS:
+        log_and_print(logger, LogLevel.ERROR, f"Unknown pydriller backend {backend}, expected one of {', '.join(BACKENDS)}")
+        return
+    if output_format not in OUTPUT_FORMATS or diff_content not in DIFF_CONTENT_MODES:
+        log_and_print(logger, LogLevel.ERROR, f"Unknown pydriller output options {output_format}/{diff_content}")
+        return
+    
     log_and_print(logger, LogLevel.INFO, f"\nTotal count of repositories: {len(repository_directories)}")
     
-    for repo_path in repository_directories:
-        count += 1
-        repo_name = os.path.basename(repo_path.strip('/'))
-        log_and_print(logger, LogLevel.INFO, f"\nChecking repository: {repo_name} ({count}/{len(repository_directories)})")
-        
-        status, filtered_commits = get_refactored_commits(repo_name, logger)
-        
-        if  status in ["Warning!", "Error!"] and filtered_commits:
-            error_repos.append((repo_name, filtered_commits))
-            continue
-        if  status in ["OK!"] and filtered_commits:
-            log_and_print(logger, LogLevel.INFO, f"Total count of refactored commits: {len(filtered_commits)}")
-            log_and_print(logger, LogLevel.INFO, f"Pydriller started: {repo_name}")
-            pydrill(repo_path, filtered_commits, logger)
-            succesful_repos.append(repo_name)
-        else:
-            log_and_print(logger, LogLevel.INFO, f"No refactoring detected in {repo_name}, skipping repository.")
-            skipped_repos.append(repo_name)
+    # Diff parsing is CPU-bound Python, so repositories are spread across processes instead of threads
+    workers = max(1, workers)
+    if workers > 1:
+        log_and_print(logger, LogLevel.INFO, f"Running pydriller in {workers} processes")
+        # Run from a thread of the event loop, and forking a process with threads can deadlock
+        root_logger = logging.getLogger()
+        log_files = [handler.baseFilename for handler in root_logger.handlers if isinstance(handler, logging.FileHandler)]
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker_logging,
+            initargs=(log_files, root_logger.level),
+        )
+        futures = {
+            executor.submit(process_repository, repo_path, backend, output_format, diff_content): repo_path
+            for repo_path in repository_directories
+        }
+        outcomes = iter_outcomes(futures)
+    else:
+        executor = None
+        outcomes = (process_repository(repo_path, backend, output_format, diff_content) for repo_path in repository_directories)
+    
+    try:
+        for repo_name, outcome, reason in outcomes:
+            count += 1
+            log_and_print(logger, LogLevel.INFO, f"\nFinished repository: {repo_name} ({count}/{len(repository_directories)})")
+            
+            if outcome == "success":
+                succesful_repos.append(repo_name)
+            elif outcome == "skipped":
+                skipped_repos.append(repo_name)
+            elif outcome == "unchanged":
+                unchanged_repos.append(repo_name)
+            else:
+                error_repos.append((repo_name, reason))
+    finally:
+        if executor:
+            executor.shutdown()
     
     if succesful_repos:
         succesful_repos.sort()
@@ -115,6 +353,12 @@ def run_pydriller(cloned_repositories_dir):
         for repo in skipped_repos:
             log_and_print(logger, LogLevel.INFO, f"-{repo}")
     
+    if unchanged_repos:
+        unchanged_repos.sort()
+        log_and_print(logger, LogLevel.INFO, f"\nSkipped {len(unchanged_repos)}/{len(repository_directories)} repositories whose inputs have not changed since the last run:")
+        for repo in unchanged_repos:
+            log_and_print(logger, LogLevel.INFO, f"-{repo}")
+    
     if error_repos:
         error_repos.sort()
         log_and_print(logger, LogLevel.ERROR, f"\nFailed to pydrill {len(error_repos)}/{len(repository_directories)} repositories:")
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import os
+
+from util import LogLevel, log_and_print
+
+"""
+Shared object stores for clones of related repositories. Clones that have a root commit in
+common (forks, modules split from one upstream) are grouped, the objects of a group are
+fetched into one bare repository in the store directory and every clone of the group
+borrows objects from it through git alternates, so each object is kept on disk only once.
+index.json in the store directory records the repositories of every store, and new clones
+of an organization that is already in a store are cloned with --reference-if-able to it.
+The clones depend on the stores, so the store directory must not be moved or deleted.
+"""
+
+INDEX_FILE = "index.json"
+
+
+async def run_git(args, logger, log_errors=True):
+    """Run a git command, returning (returncode, stdout)."""
+    proc = await asyncio.create_subprocess_exec(
+        "git", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await proc.communicate()
+
+    if proc.returncode != 0 and log_errors:
+        log_and_print(
+            logger,
+            LogLevel.ERROR,
+            f"git {' '.join(args)} exited with {proc.returncode}: {stderr.decode().strip()}",
+        )
+
+    return proc.returncode, stdout.decode()
+
+
+def load_index(store_dir):
+    """Return {store name: [repository URLs]}."""
+    try:
+        with open(os.path.join(store_dir, INDEX_FILE), "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_index(store_dir, index):
+    path = os.path.join(store_dir, INDEX_FILE)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(index, file, indent=4)
+    os.replace(f"{path}.tmp", path)
+
+
+def get_owner(url):
+    return url.rstrip("/").split(":")[-1].split("/")[-2].lower()
+
+
+def get_reference_stores(url, store_dir, index):
+    """Absolute paths of the stores that hold repositories of the same organization as url."""
+    owner = get_owner(url)
+    return [
+        os.path.abspath(os.path.join(store_dir, store))
+        for store, urls in index.items()
+        if any(get_owner(other) == owner for other in urls)
+    ]
+
+
+async def get_root_commits(repository_path, logger):
+    returncode, stdout = await run_git(
+        ["-C", repository_path, "rev-list", "--max-parents=0", "--all"], logger
+    )
+    return set(stdout.split()) if returncode == 0 else set()
+
+
+async def is_partial_clone(repository_path, logger):
+    # The blobs missing from a partial clone can't be fetched into a store
+    _, stdout = await run_git(
+        ["-C", repository_path, "config", "--get", "remote.origin.promisor"],
+        logger,
+        log_errors=False,
+    )
+    return stdout.strip() == "true"
+
+
+def group_by_root_commits(root_commits):
+    """
+    Group the repositories that have a root commit in common, directly or through other
+    repositories. root_commits maps a repository to its root commits.
+    Returns the groups of more than one repository as sorted lists.
+    """
+    groups = []
+    group_of_root = {}
+
+    for repository, roots in root_commits.items():
+        group = {repository}
+        for root in roots:
+            other = group_of_root.get(root)
+            if other is not None and other is not group:
+                group |= other
+                groups.remove(other)
+        groups.append(group)
+        for member in group:
+            for root in root_commits[member]:
+                group_of_root[root] = group
+
+    return [sorted(group) for group in groups if len(group) > 1]
+
+
+def get_store_name(group_urls, group_roots, index):
+    # Keep using the store a member is already in, so stores stay stable between runs
+    for store, urls in index.items():
+        if not group_urls.isdisjoint(urls):
+            return store
+    return f"{min(group_roots)}.git"
+
+
+async def add_alternate(repository_path, store_objects_dir, logger):
+    """Make the repository borrow objects from the store, returns False if it already did."""
+    _, stdout = await run_git(
+        ["-C", repository_path, "rev-parse", "--git-path", "objects"], logger
+    )
+    objects_dir = os.path.join(repository_path, stdout.strip())
+    alternates_file = os.path.join(objects_dir, "info", "alternates")
+
+    alternates = []
+    if os.path.exists(alternates_file):
+        with open(alternates_file, "r") as file:
+            alternates = file.read().split()
+    if store_objects_dir in alternates:
+        return False
+
+    os.makedirs(os.path.dirname(alternates_file), exist_ok=True)
+    with open(alternates_file, "a") as file:
+        file.write(f"{store_objects_dir}\n")
+    return True
+
+
+async def share_group(repositories, store_path, logger):
+    """Fetch the objects of the repositories into the store and link the repositories to it."""
+    if not os.path.exists(store_path):
+        await run_git(["init", "--quiet", "--bare", store_path], logger)
+
+    store_objects_dir = os.path.join(store_path, "objects")
+
+    for repository_path in repositories:
+        name = os.path.basename(repository_path)
+        # The refs keep the objects reachable in the store, so they are never pruned from it
+        returncode, _ = await run_git(
+            [
+                "-C",
+                store_path,
+                "fetch",
+                "--quiet",
+                "--no-tags",
+                os.path.abspath(repository_path),
+                f"+refs/*:refs/shared/{name}/*",
+            ],
+            logger,
+        )
+        if returncode != 0:
+            continue
+
+        if await add_alternate(repository_path, store_objects_dir, logger):
+            # -l leaves out the objects found in the store, so the local copies are dropped
+            await run_git(
+                ["-C", repository_path, "repack", "-a", "-d", "-l", "-q"], logger
+            )
+
+
+async def update_shared_stores(repositories, store_dir, semaphore, logger):
+    """
+    Group the cloned repositories by root commits and share the objects of every group.
+    repositories maps a clone path to its URL.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    async def get_candidate_roots(repository_path):
+        async with semaphore:
+            if await is_partial_clone(repository_path, logger):
+                return repository_path, set()
+            return repository_path, await get_root_commits(repository_path, logger)
+
+    root_commits = dict(
+        await asyncio.gather(
+            *(get_candidate_roots(path) for path in repositories if os.path.isdir(path))
+        )
+    )
+    groups = group_by_root_commits(
+        {path: roots for path, roots in root_commits.items() if roots}
+    )
+    index = load_index(store_dir)
+
+    async def share(group):
+        group_urls = {repositories[path] for path in group}
+        group_roots = set.union(*(root_commits[path] for path in group))
+        store_name = get_store_name(group_urls, group_roots, index)
+
+        async with semaphore:
+            await share_group(
+                group, os.path.abspath(os.path.join(store_dir, store_name)), logger
+            )
+        return store_name, group_urls
+
+    for store_name, group_urls in await asyncio.gather(*(share(group) for group in groups)):
+        index[store_name] = sorted(group_urls.union(index.get(store_name, [])))
+
+    save_index(store_dir, index)
+
+    log_and_print(
+        logger,
+        LogLevel.INFO,
+        f"{sum(len(group) for group in groups)} repositories share objects"
+        f" in {len(groups)} stores in {store_dir}",
+    )
@@ -0,0 +1,31 @@
+"""
+Stand-in RefactoringMiner worker that follows the protocol described in miner_workers.py.
+Every job is run with a separate RefactoringMiner process, so it saves no JVM startups. It is
+for testing the worker mode, RefactoringMinerWorker.java is the worker that keeps RefactoringMiner
+loaded.
+
+Usage: python stub_miner_worker.py <RefactoringMiner executable>
+"""
+
+import json
+import shlex
+import subprocess
+import sys
+
+
+def main():
+    executable = sys.argv[1]
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+
+        job = json.loads(line)
+        command = f"{executable} {' '.join(shlex.quote(arg) for arg in job['args'])}"
+        # stdout is reserved for the responses, so the miner log goes to stderr
+        result = subprocess.run(command, shell=True, stdout=sys.stderr)
+        print(json.dumps({"id": job["id"], "returncode": result.returncode}), flush=True)
+
+
+if __name__ == "__main__":
+    main()